@@ -1,90 +1,22 @@
-import sys
 import pathlib
 import asyncio
 import itertools as it
-from typing import Tuple, List
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, List, Tuple
+import numpy as np
+from intcode import IntcodeVM, Trace
+from intcode_batch import BatchVM
+from intcode_net import Channel, Scheduler
+from intcode_store import load_program
 
 
 async def intcomputer(
-    intcode: str, q_in: asyncio.Queue, q_out: asyncio.Queue, name="name", verbose=True
+    intcode: str, q_in: asyncio.Queue, q_out: asyncio.Queue, name="name", verbose=False
 ):
-    def _decode_opcode(n: int) -> Tuple[int, bool, bool, bool]:
-        op = n % 100  # take two right-most digits as int
-        s = str(n).zfill(5)
-        mode3 = (
-            s[0] == "0"
-        )  # '0' position mode, '1' immediate mode ('2': relative mode in day 9)
-        mode2 = s[1] == "0"  # True === position mode (pointer)
-        mode1 = s[2] == "0"  # False === immediate mode (value)
-        return op, mode1, mode2, mode3
-
-    def _bin_op(f, xs: List[int], loc: int, *mode) -> Tuple[List[int], int]:
-        left = xs[xs[loc + 1]] if mode[0] else xs[loc + 1]
-        right = xs[xs[loc + 2]] if mode[1] else xs[loc + 2]
-        if mode[2]:
-            xs[xs[loc + 3]] = f(left, right)
-        else:
-            raise ValueError("Something is wrong")
-        return xs, loc + 4
-
-    def _add(xs: List[int], loc: int, *mode) -> Tuple[List[int], int]:
-        return _bin_op(lambda a, b: a + b, xs, loc, *mode)
-
-    def _mul(xs: List[int], loc: int, *mode) -> Tuple[List[int], int]:
-        return _bin_op(lambda a, b: a * b, xs, loc, *mode)
-
-    async def _in(xs: List[int], loc: int, *mode) -> Tuple[List[int], int]:
-        xs[xs[loc + 1]] = await q_in.get()
-        return xs, loc + 2
-
-    async def _out(xs: List[int], loc: int, *mode) -> Tuple[List[int], int]:
-        out = xs[xs[loc + 1]] if mode[0] else xs[loc + 1]
-        await q_out.put(out)
-        return xs, loc + 2
-
-    def _jmp_true(xs: List[int], loc: int, *mode) -> Tuple[List[int], int]:
-        x = xs[xs[loc + 1]] if mode[0] else xs[loc + 1]
-        if x > 0:
-            loc = xs[xs[loc + 2]] if mode[1] else xs[loc + 2]
-        else:
-            loc += 3
-        return xs, loc
-
-    def _jmp_false(xs: List[int], loc: int, *mode) -> Tuple[List[int], int]:
-        x = xs[xs[loc + 1]] if mode[0] else xs[loc + 1]
-        if x == 0:
-            loc = xs[xs[loc + 2]] if mode[1] else xs[loc + 2]
-        else:
-            loc += 3
-        return xs, loc
-
-    def _lt(xs: List[int], loc: int, *mode) -> Tuple[List[int], int]:
-        return _bin_op(lambda a, b: int(a < b), xs, loc, *mode)
-
-    def _eq(xs: List[int], loc: int, *mode) -> Tuple[List[int], int]:
-        return _bin_op(lambda a, b: int(a == b), xs, loc, *mode)
-
-    opfun = {
-        1: _add,
-        2: _mul,
-        3: _in,
-        4: _out,
-        5: _jmp_true,
-        6: _jmp_false,
-        7: _lt,
-        8: _eq,
-    }
-
-    loc = 0
-    while intcode[loc] != 99:
-        print(f"{name}: processing {intcode[loc]} at {loc}", file=sys.stderr)
-        opcode = intcode[loc]
-        op, mode1, mode2, mode3 = _decode_opcode(opcode)
-        f = opfun[op]
-        if asyncio.iscoroutinefunction(f):
-            intcode, loc = await f(intcode, loc, mode1, mode2, mode3)
-        else:
-            intcode, loc = f(intcode, loc, mode1, mode2, mode3)
+    trace = Trace(name=name) if verbose else None
+    await IntcodeVM(intcode, trace=trace).serve(q_in, q_out)
 
 
 async def day07_amp(intcode: str, phases: List[int], verbose=False):
@@ -119,53 +51,160 @@ async def day07_amp(intcode: str, phases: List[int], verbose=False):
     return res
 
 
-async def day07_amp_feedback(intcode: str, phases: List[int], verbose=False):
+def day07_amp_feedback(intcode: str, phases: List[int], verbose=False):
+    """
+    >>> day07_amp_feedback([3,26,1001,26,-4,26,3,27,1002,27,2,27,1,27,26,27,4,27,1001,28,-1,28,1005,28,6,99,0,0,5], [9,8,7,6,5])
+    139629729
+    """
     if isinstance(phases, int):
         phases = str(phases)
     if isinstance(phases, str):
         phases = list(map(int, phases))
 
-    qs = [asyncio.Queue() for _ in range(5)]
-    for phase, q in zip(phases, qs):
-        q.put_nowait(phase)
-    qs[0].put_nowait(0)
+    n = len(phases)
+    chs = [Channel(16) for _ in range(n)]
+    for phase, ch in zip(phases, chs):
+        ch.put(phase)
+    chs[0].put(0)
+
+    net = Scheduler()
+    for i in range(n):
+        net.spawn(IntcodeVM(intcode[:]), chs[i], chs[(i + 1) % n], name=f"amp-{i}")
+    net.run()
+    return chs[0].get()
+
+
+def day07_search(intcode: List[int], choices: Iterable[int]) -> int:
+    """
+    Highest signal of the amplifiers in series over all phase orders
+
+    A single amplifier's output depends only on its phase and input signal,
+    so each (phase, signal) pair is run once and orders sharing a prefix
+    share its work.
 
-    tasks = []
-    for i in range(5):
-        i_next = (i + 1) % 5
-        task = asyncio.create_task(
-            intcomputer(intcode[:], qs[i], qs[i_next], name=f"comp-{i}")
+    >>> day07_search([3,15,3,16,1002,16,10,16,1,16,15,15,4,15,99,0,0], range(5))
+    43210
+    """
+    choices = tuple(choices)
+    cache: Dict[Tuple[int, int], int] = {}
+
+    def run(phase: int, signal: int) -> int:
+        return _amp_output(intcode, phase, signal, cache)
+
+    def best(signal: int, left: Tuple[int, ...]) -> int:
+        if not left:
+            return signal
+        return max(
+            best(run(phase, signal), left[:i] + left[i + 1 :])
+            for i, phase in enumerate(left)
         )
-        tasks.append(task)
 
-    await asyncio.gather(*tasks)
+    return best(0, choices)
 
-    try:
-        res = qs[0].get_nowait()
-    except asyncio.QueueEmpty:
-        raise ValueError("Failed to get the remnant of queue")
-    return res
 
+def _amp_output(
+    intcode: List[int], phase: int, signal: int, cache: Dict[Tuple[int, int], int]
+) -> int:
+    key = (phase, signal)
+    if key not in cache:
+        vm = IntcodeVM(intcode[:])
+        vm.feed([phase, signal])
+        vm.run_until_input()
+        cache[key] = vm.drain_output().popleft()
+    return cache[key]
 
-async def day07(verbose=True):
-    intcode = day07_read()
-    choices = range(5)
 
-    res = 0
-    for phases in it.permutations(choices):
-        tmp = await day07_amp(intcode, phases, verbose=verbose)
-        if tmp > res:
-            res = tmp
-    print(res)
+# state of a day07_parallel worker process, set once by _init_worker
+_program: List[int] = []
+_feedback = False
+_cache: Dict[Tuple[int, int], int] = {}
+
+
+def _init_worker(intcode: List[int], feedback: bool):
+    global _program, _feedback
+    _program = intcode
+    _feedback = feedback
+    _cache.clear()
+
+
+def _worker_signal(phases: Tuple[int, ...]) -> int:
+    if _feedback:
+        return day07_amp_feedback(_program, phases)
+    signal = 0
+    for phase in phases:
+        signal = _amp_output(_program, phase, signal, _cache)
+    return signal
+
+
+def day07_parallel(
+    intcode: List[int], choices: Iterable[int], feedback=False, workers=None, chunksize=None
+) -> int:
+    """
+    Highest signal over all phase orders, spread over a process pool
+
+    The program is sent to each worker once, by the pool initializer;
+    tasks carry only the phase orders. Series workers keep their own
+    (phase, signal) cache across tasks. By default the orders are cut
+    into about four tasks per worker, so that every worker gets some.
+
+    >>> day07_parallel([3,15,3,16,1002,16,10,16,1,16,15,15,4,15,99,0,0], range(5), workers=2)
+    43210
+    """
+    choices = tuple(choices)
+    workers = workers or os.cpu_count() or 1
+    if chunksize is None:
+        chunksize = max(1, math.perm(len(choices)) // (4 * workers))
+    with ProcessPoolExecutor(
+        max_workers=workers, initializer=_init_worker, initargs=(intcode, feedback)
+    ) as pool:
+        return max(pool.map(_worker_signal, it.permutations(choices), chunksize=chunksize))
+
+
+def day07_batch(intcode: List[int], choices: Iterable[int], feedback=False) -> int:
+    """
+    Highest signal over all phase orders, with one lockstep BatchVM per
+    amplifier whose lanes are the phase orders
+
+    >>> day07_batch([3,15,3,16,1002,16,10,16,1,16,15,15,4,15,99,0,0], range(5))
+    43210
+    >>> day07_batch([3,26,1001,26,-4,26,3,27,1002,27,2,27,1,27,26,27,4,27,1001,28,-1,28,1005,28,6,99,0,0,5], range(5, 10), feedback=True)
+    139629729
+    """
+    orders = np.array(list(it.permutations(choices)), dtype=np.int64)
+    lanes = np.arange(len(orders))
+    amps = [BatchVM(intcode, len(orders)) for _ in range(orders.shape[1])]
+    for amp, phases in zip(amps, orders.T):
+        amp.feed(phases)
+
+    signal = np.zeros(len(orders), dtype=np.int64)
+    while True:
+        for amp in amps:
+            amp.feed(signal)
+            amp.run()
+            out, counts = amp.drain_output()
+            signal = out[lanes, counts - 1]
+        if not feedback or amps[-1].halted.all():
+            return int(signal.max())
+
+
+def day07(parallel=False):
+    intcode = day07_read()
+    if parallel:
+        print(day07_parallel(intcode, range(5)))
+    else:
+        print(day07_search(intcode, range(5)))
 
 
-async def day07_mod():
+def day07_mod(parallel=False):
     intcode = day07_read()
     choices = range(5, 10)
+    if parallel:
+        print(day07_parallel(intcode, choices, feedback=True))
+        return
 
     res = 0
     for phases in it.permutations(choices):
-        tmp = await day07_amp_feedback(intcode, phases)
+        tmp = day07_amp_feedback(intcode, phases)
         if tmp > res:
             res = tmp
     print(res)
@@ -175,12 +214,11 @@ def get_path(day):
     return pathlib.Path(f"./2019/day{day:02}.txt")
 
 
-def day07_read():
-    file_ = get_path(7)
-    assert file_.exists()
-    return [int(w) for w in open(file_).read().split(",")]
+def day07_read() -> List[int]:
+    # a plain list: the amplifiers slice it, and the pool pickles it to workers
+    return list(load_program(get_path(7)).base)
 
 
 if __name__ == "__main__":
-    asyncio.run(day07())
-    # asyncio.run(day07_mod())
+    day07()
+    # day07_mod()
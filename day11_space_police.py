@@ -1,159 +1,135 @@
-import sys
 import pathlib
 import asyncio
 import itertools as it
-import collections
-from typing import Tuple, List, DefaultDict
+from typing import Tuple, List, Dict, Generator, Iterator, Mapping, Optional
+from intcode import HALTED, IntcodeVM, Memory, Trace
+from intcode_store import load_program
+from raster import rasterize
 
-Intcode = DefaultDict[int, int]
-Modes = Tuple[str, str, str]
 Position = Tuple[int, int]
 Facing = int
 
 async def intcomputer(
-    intcode: str, q_in: asyncio.Queue, q_out: asyncio.Queue, name="name", verbose=True
+    intcode: str, q_in: asyncio.Queue, q_out: asyncio.Queue, name="name", verbose=False
 ):
-    def _decode_opcode(n: int) -> Tuple[int, Modes]:
-        op = n % 100  # take two right-most digits as int
-        s = str(n).zfill(5)
-        # '0' position mode, '1' immediate mode, '2': relative mode
-        modes = (s[2], s[1], s[0])
-        return op, modes
-
-    def _get_addr(xs: Intcode, loc: int, m: str, relbase: int) -> int:
-        if m == "0":
-            res = xs[loc]
-        elif m == "1":
-            res = loc
-        else:
-            assert m == "2"
-            res = relbase + xs[loc]
-        return res
-
-    def _bin_op(
-        f, xs: Intcode, loc: int, mode: Modes, relbase: int
-    ) -> Tuple[Intcode, int, int]:
-        left = _get_addr(xs, loc + 1, mode[0], relbase)
-        right = _get_addr(xs, loc + 2, mode[1], relbase)
-        target = _get_addr(xs, loc + 3, mode[2], relbase)
-        xs[target] = f(xs[left], xs[right])
-        return xs, loc + 4, relbase
-
-    def _add(
-        xs: Intcode, loc: int, mode: Modes, relbase: int
-    ) -> Tuple[Intcode, int, int]:
-        return _bin_op(lambda a, b: a + b, xs, loc, mode, relbase)
-
-    def _mul(
-        xs: Intcode, loc: int, mode: Modes, relbase: int
-    ) -> Tuple[Intcode, int, int]:
-        return _bin_op(lambda a, b: a * b, xs, loc, mode, relbase)
-
-    async def _in(
-        xs: Intcode, loc: int, mode: Modes, relbase: int
-    ) -> Tuple[Intcode, int, int]:
-        target = _get_addr(xs, loc+1, mode[0], relbase)
-        xs[target] = await q_in.get()
-        return xs, loc + 2, relbase
-
-    async def _out(
-        xs: Intcode, loc: int, mode: Modes, relbase: int
-    ) -> Tuple[Intcode, int, int]:
-        target = _get_addr(xs, loc + 1, mode[0], relbase)
-        await q_out.put(xs[target])
-        return xs, loc + 2, relbase
-
-    def _jmp_true(
-        xs: Intcode, loc: int, mode: Modes, relbase: int
-    ) -> Tuple[Intcode, int]:
-        addr = _get_addr(xs, loc + 1, mode[0], relbase)
-        if xs[addr] > 0:
-            target = _get_addr(xs, loc + 2, mode[1], relbase)
-            loc = xs[target]
-        else:
-            loc += 3
-        return xs, loc, relbase
-
-    def _jmp_false(
-        xs: Intcode, loc: int, mode: Modes, relbase: int
-    ) -> Tuple[Intcode, int]:
-        addr = _get_addr(xs, loc + 1, mode[0], relbase)
-        if xs[addr] == 0:
-            target = _get_addr(xs, loc + 2, mode[1], relbase)
-            loc = xs[target]
-        else:
-            loc += 3
-        return xs, loc, relbase
-
-    def _lt(xs: Intcode, loc: int, mode: Modes, relbase: int) -> Tuple[Intcode, int]:
-        return _bin_op(lambda a, b: int(a < b), xs, loc, mode, relbase)
-
-    def _eq(xs: Intcode, loc: int, mode: Modes, relbase: int) -> Tuple[Intcode, int]:
-        return _bin_op(lambda a, b: int(a == b), xs, loc, mode, relbase)
-
-    def _adj_relbase(
-        xs: Intcode, loc: int, mode: Modes, relbase: int
-    ) -> Tuple[Intcode, int]:
-        addr = _get_addr(xs, loc + 1, mode[0], relbase)
-        inc = xs[addr]
-        return xs, loc + 2, relbase + inc
-
-    opfun = {
-        1: _add,
-        2: _mul,
-        3: _in,
-        4: _out,
-        5: _jmp_true,
-        6: _jmp_false,
-        7: _lt,
-        8: _eq,
-        9: _adj_relbase,
-    }
-
-    loc = 0
-    relbase = 0
-    d = collections.defaultdict(int)
-    for i, x in enumerate(intcode):
-        d[i] = x
-    intcode = d
-    while intcode[loc] != 99:
-        if verbose:
-            print(
-                f"{name}: processing {intcode[loc]} at {loc} with relbase {relbase}, q_in={q_in}, q_out={q_out}",
-                file=sys.stderr,
-            )
-        opcode = intcode[loc]
-        op, mode = _decode_opcode(opcode)
-        f = opfun[op]
-        if asyncio.iscoroutinefunction(f):
-            intcode, loc, relbase = await f(intcode, loc, mode, relbase)
-        else:
-            intcode, loc, relbase = f(intcode, loc, mode, relbase)
+    trace = Trace(name=name) if verbose else None
+    try:
+        await IntcodeVM(intcode, trace=trace).serve(q_in, q_out)
+    finally:
+        await q_out.put(HALTED)
 
 
 def get_path(day):
     return pathlib.Path(f"./2019/day{day:02}.txt")
 
 
-def day11_read():
-    file_ = get_path(11)
-    assert file_.exists()
-    return [int(w) for w in open(file_).read().split(",")]
+def day11_read() -> Memory:
+    return load_program(get_path(11)).memory()
+
+
+class TileGrid(object):
+    """
+    Unbounded grid of small colors, stored as 64x64 bytearray tiles
+
+    Each tile also has a bit plane of the cells ever painted. Tiles are
+    allocated on first write, and reads of untouched cells give 0. The
+    tile last used is kept at hand, so a walk that stays within a tile
+    does not look tiles up.
+
+    >>> g = TileGrid()
+    >>> g.paint(-1, 70, 1), g.paint(-1, 70, 1), g[(-1, 70)], g[(5, 5)]
+    (True, False, 1, 0)
+    >>> g.paint(-1, 70, 0), g.painted
+    (True, 1)
+    >>> g[(200, 0)] = 1
+    >>> sorted(g.items())
+    [((-1, 70), 0), ((200, 0), 1)]
+    """
+
+    SHIFT = 6
+    SIZE = 1 << SHIFT
+    MASK = SIZE - 1
+
+    def __init__(self):
+        self.tiles: Dict[Tuple[int, int], Tuple[bytearray, bytearray]] = {}
+        self.painted = 0
+        self._tx = self._ty = None
+        self._tile: Optional[Tuple[bytearray, bytearray]] = None
+
+    def _find(self, x: int, y: int, create: bool):
+        tx, ty = x >> self.SHIFT, y >> self.SHIFT
+        if tx == self._tx and ty == self._ty:
+            return self._tile
+        tile = self.tiles.get((tx, ty))
+        if tile is None:
+            if not create:
+                return None
+            size = self.SIZE
+            tile = self.tiles[(tx, ty)] = (bytearray(size * size), bytearray(size * size // 8))
+        self._tx, self._ty, self._tile = tx, ty, tile
+        return tile
+
+    def get(self, x: int, y: int) -> int:
+        tile = self._find(x, y, create=False)
+        if tile is None:
+            return 0
+        return tile[0][(y & self.MASK) << self.SHIFT | (x & self.MASK)]
+
+    def paint(self, x: int, y: int, color: int) -> bool:
+        """Set the color of (x, y) and mark it painted; False if it had that color"""
+        colors, bits = self._find(x, y, create=True)
+        i = (y & self.MASK) << self.SHIFT | (x & self.MASK)
+        if colors[i] == color:
+            return False
+        colors[i] = color
+        if not bits[i >> 3] & (1 << (i & 7)):
+            bits[i >> 3] |= 1 << (i & 7)
+            self.painted += 1
+        return True
+
+    def __getitem__(self, pos: Position) -> int:
+        return self.get(*pos)
+
+    def __setitem__(self, pos: Position, color: int):
+        """Set a color without counting it as painted"""
+        x, y = pos
+        colors, _ = self._find(x, y, create=True)
+        colors[(y & self.MASK) << self.SHIFT | (x & self.MASK)] = color
+
+    def items(self) -> Iterator[Tuple[Position, int]]:
+        """Cells that are colored or were ever painted"""
+        size = self.SIZE
+        for (tx, ty), (colors, bits) in self.tiles.items():
+            for i, color in enumerate(colors):
+                if color or bits[i >> 3] & (1 << (i & 7)):
+                    yield (tx * size + (i & self.MASK), ty * size + (i >> self.SHIFT)), color
+
+    def __iter__(self) -> Iterator[Position]:
+        return (pos for pos, _ in self.items())
+
+    def __repr__(self) -> str:
+        return f"TileGrid(tiles={len(self.tiles)}, painted={self.painted})"
 
 
 class RobotAndFieldState(object):
-    def __init__(self, loc: Position, facing: Facing):
-        self.loc = loc
+    # < ^ > v
+    DIRS = [(-1, 0), (0, 1), (1, 0), (0, -1)]
+
+    def __init__(self, loc: Position, facing: Facing, verbose=False):
+        self.x, self.y = loc
         self.facing = facing
-        self.field = collections.defaultdict(int)
-        self.painted_panel = set()
+        self.field = TileGrid()
+        self.verbose = verbose
+
+    @property
+    def loc(self) -> Position:
+        return (self.x, self.y)
 
     def _update_field(self, color):
-        if self.field[self.loc] != color:
-            self.painted_panel.add(self.loc)
-            self.field[self.loc] = color
-            print(f"Painted {color} at {self.loc}")
-        else:
+        if self.field.paint(self.x, self.y, color):
+            if self.verbose:
+                print(f"Painted {color} at {self.loc}")
+        elif self.verbose:
             print(f"Did nothing at {self.loc}")
 
     def _update_facing(self, dir_move):
@@ -161,78 +137,65 @@ class RobotAndFieldState(object):
         self.facing = (self.facing + shift) % 4
 
     def _update_loc(self):
-        dirs = [(-1, 0), (0, 1), (1, 0), (0, -1)]
-        diff = dirs[self.facing]
-        self.loc = (self.loc[0] + diff[0], self.loc[1] + diff[1])
+        dx, dy = self.DIRS[self.facing]
+        self.x += dx
+        self.y += dy
 
-    def update(self, commands: asyncio.Queue):
+    def update(self, commands: List[int]):
         color, dir_move = commands
         self._update_field(color)
         self._update_facing(dir_move)
         self._update_loc()
 
     def get_color(self):
-        return self.field[self.loc]
+        return self.field.get(self.x, self.y)
 
     def get_paint_count(self):
-        return len(self.painted_panel)
+        return self.field.painted
+
+    def drive(self, machine: Generator[Optional[int], int, None]):
+        """Run the robot program from IntcodeVM.coroutine() until it halts"""
+        try:
+            request = next(machine)
+            while True:
+                assert request is None
+                color = machine.send(self.get_color())
+                dir_move = next(machine)
+                self.update([color, dir_move])
+                request = next(machine)
+        except StopIteration:
+            pass
 
     async def run(self, queue_in: asyncio.Queue, queue_out: asyncio.Queue):
+        """Run until the machine puts HALTED on `queue_out`"""
         while True:
-            print(" ... runing env update")
-            try:
-                color = await asyncio.wait_for(queue_out.get(), timeout=1.0)
-                dir_move = await asyncio.wait_for(queue_out.get(), timeout=1.0)
-            except asyncio.TimeoutError:
-                print("Timeout!")
-                print(f"Painted {len(self.painted_panel)} panels!")
+            if self.verbose:
+                print(" ... runing env update")
+            color = await queue_out.get()
+            if color is HALTED:
                 break
+            dir_move = await queue_out.get()
+            if dir_move is HALTED:
+                raise ValueError("machine halted between color and turn")
             self.update([color, dir_move])
             next_input = self.get_color()
             await queue_in.put(next_input)
+        print(f"Painted {self.get_paint_count()} panels!")
 
 
-async def day11_robot(intcode) -> asyncio.Queue:
+def day11_robot(intcode) -> int:
     """
     loc ... 2-d position (x, y)
     facing ... < ^ > v  as [0, 1, 2, 3]
     """
     env = RobotAndFieldState(loc=(0, 0), facing=1)
-    q_in = asyncio.Queue()
-    q_out = asyncio.Queue()
-    q_in.put_nowait(env.get_color())
-
-    tasks = []
-    tasks.append(asyncio.create_task(intcomputer(intcode, q_in, q_out)))
-    tasks.append(asyncio.create_task(env.run(q_in, q_out)))
-    await asyncio.gather(*tasks)
-
-    print(q_in)
-    print(q_out)
-
-
-def draw(d: DefaultDict):
-    xmin = 1000000000
-    ymin = 1000000000
-    xmax = -xmin
-    ymax = -ymin
-    for (x, y) in d:
-        xmin = min(x, xmin)
-        xmax = max(x, xmax)
-        ymin = min(y, ymin)
-        ymax = max(y, ymax)
+    env.drive(IntcodeVM(intcode).coroutine())
+    print(f"Painted {env.get_paint_count()} panels!")
+    return env.get_paint_count()
 
-    res = [["."] * (xmax - xmin + 1) for _ in range(ymin, ymax + 1)]
-    for i, y in enumerate(range(ymin, ymax + 1)):
-        for j, x in enumerate(range(xmin, xmax +1)):
-            if d[(x, y)] == 1:
-                res[i][j] = '#'
 
-    # revert y-dir
-    grid = []
-    for xs in res[::-1]:
-        line = grid.append(("".join(xs)))
-        print(line)
+def draw(d: Mapping[Position, int]):
+    rasterize(d, flip_y=True).show(".#")
 
 
 async def day11_robot_mod(intcode) -> asyncio.Queue:
@@ -260,7 +223,7 @@ if __name__ == "__main__":
     # intcode = [1102, 34915192, 34915192, 7, 4, 7, 99, 0]
     # intcode = [104, 1125899906842624, 99]
     intcode = day11_read()
-    print(intcode)
+    print(list(intcode))
 
     # asyncio.run(day09(intcode, [1]))
     asyncio.run(day11_robot_mod(intcode))
@@ -25,10 +25,10 @@ Note that x, y and z components are independent; i.e. we can treat them separate
 
 
 """
-import copy
 import functools
 import math
 import pathlib
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 
 # import plotly
@@ -61,10 +61,62 @@ def day12_parse(inputs):
     return res
 
 
-def _day12_update(xs: np.array, vs: np.array):
-    for i, _ in enumerate(xs):
-        v_diffs = np.sign(xs - xs[i])
-        vs[i] += v_diffs.sum(axis=0)
+# from this many bodies on, gravity is computed from ranks instead of pairs
+RANK_MIN_BODIES = 32
+
+
+def _workspace(xs: np.array) -> np.array:
+    n, dim = xs.shape
+    if n >= RANK_MIN_BODIES:
+        return None
+    return np.empty((n, n, dim), dtype=xs.dtype)
+
+
+def _rank_gravity(xs: np.array, vs: np.array):
+    """
+    v_k += sum_i sign(x_i - x_k) in O(N log N): on each axis the sum is the
+    number of bodies ahead of k minus the number behind, both read off the
+    sorted positions, with ties counting for neither
+
+    >>> xs = np.random.default_rng(0).integers(-5, 5, size=(50, 3))
+    >>> vs = np.zeros_like(xs)
+    >>> _rank_gravity(xs, vs)
+    >>> bool((vs == np.sign(xs[None, :, :] - xs[:, None, :]).sum(axis=1)).all())
+    True
+    """
+    n = len(xs)
+    ordered = np.sort(xs, axis=0)
+    for axis in range(xs.shape[1]):
+        s, col = ordered[:, axis], xs[:, axis]
+        behind = np.searchsorted(s, col, side="left")
+        ahead = n - np.searchsorted(s, col, side="right")
+        vs[:, axis] += ahead - behind
+
+
+def _day12_update(xs: np.array, vs: np.array, buf: np.array = None):
+    """
+    One step, in place: v_k += sum_i sign(x_i - x_k), then x_k += v_k
+
+    Below RANK_MIN_BODIES all signs are computed in one broadcast into
+    `buf`, an (n, n, 3) workspace from _workspace(), which stays small at
+    those sizes. From RANK_MIN_BODIES on, _rank_gravity() is used instead.
+
+    >>> xs = np.array([[-1, 0, 2], [2, -10, -7], [4, -8, 8], [3, 5, -1]])
+    >>> vs = np.zeros_like(xs)
+    >>> _ = _day12_update(xs, vs)
+    >>> xs.tolist(), vs.tolist()
+    ([[2, -1, 1], [3, -7, -4], [1, -7, 5], [2, 2, 0]], [[3, -1, -1], [1, 3, 3], [-3, 1, -3], [-1, -3, 1]])
+    """
+    if len(xs) >= RANK_MIN_BODIES:
+        _rank_gravity(xs, vs)
+        xs += vs
+        return xs, vs
+
+    if buf is None:
+        buf = _workspace(xs)
+    np.subtract(xs[None, :, :], xs[:, None, :], out=buf)
+    np.sign(buf, out=buf)
+    vs += buf.sum(axis=1)
     xs += vs
 
     return xs, vs
@@ -83,36 +135,127 @@ def day12(inputs, steps=1000):
     print(f"n = {n}")
     xs = np.array(inputs)
     vs = np.zeros(shape=(n, 3), dtype=np.int64)
+    buf = _workspace(xs)
     for _ in range(steps):
-        xs, vs = _day12_update(xs, vs)
+        xs, vs = _day12_update(xs, vs, buf)
         # if xs[0, 1] == xs_y0:
         #     print(f"y-comp returned at {i}")
 
     return day12_energy(xs, vs)
 
 
-def day12_mod(inputs):
+# cells of the (systems, bodies, bodies, 3) sign tensor processed at once
+CHUNK_CELLS = 1 << 16
+
+
+def _ensemble_update(xs: np.array, vs: np.array):
+    """One step of every system of a (systems, bodies, 3) ensemble, in place"""
+    n_sys, n, dim = xs.shape
+    if n >= RANK_MIN_BODIES:
+        for k in range(n_sys):
+            _rank_gravity(xs[k], vs[k])
+    else:
+        rows = max(1, CHUNK_CELLS // (n * n * dim))
+        for start in range(0, n_sys, rows):
+            block = xs[start : start + rows]
+            diff = np.sign(block[:, None, :, :] - block[:, :, None, :])
+            vs[start : start + rows] += diff.sum(axis=2)
+    xs += vs
+
+
+def day12_ensemble(batch, steps=1000, periods=False, max_steps=None):
+    """
+    Energies of many independent systems after `steps` steps, advanced
+    together as one (systems, bodies, 3) array
+
+    With `periods`, also the (systems, 3) period of every axis of every
+    system, simulating past `steps` if needed until all are found or
+    `max_steps` is reached; axes not found by then get 0.
+
+    >>> batch = [
+    ...     [[-1, 0, 2], [2, -10, -7], [4, -8, 8], [3, 5, -1]],
+    ...     [[-8, -10, 0], [5, 5, 10], [2, -7, 3], [9, -8, -3]],
+    ... ]
+    >>> energies, found = day12_ensemble(batch, steps=10, periods=True)
+    >>> energies.tolist(), found.tolist()
+    ([179, 706], [[18, 28, 44], [2028, 5898, 4702]])
+    >>> [lcm(p) for p in found.tolist()]
+    [2772, 4686774924]
+    """
+    xs = np.array(batch, dtype=np.int64)
+    vs = np.zeros_like(xs)
+    x0 = xs.copy()
+    found = np.zeros((xs.shape[0], xs.shape[2]), dtype=np.int64)
+
+    energies = None
+    step = 0
+    while True:
+        if step == steps:
+            energies = (np.abs(xs).sum(axis=2) * np.abs(vs).sum(axis=2)).sum(axis=1)
+        if energies is not None and (
+            not periods or found.all() or (max_steps is not None and step >= max_steps)
+        ):
+            break
+        _ensemble_update(xs, vs)
+        step += 1
+        if periods:
+            back = ~vs.any(axis=1) & (xs == x0).all(axis=1)
+            found[back & (found == 0)] = step
+
+    return (energies, found) if periods else energies
+
+
+def _axis_period(x0: np.array) -> int:
+    """
+    Steps until a 1-D system started at rest from `x0` first returns to
+    its initial state
+
+    >>> _axis_period(np.array([-1, 2, 4, 3]))
+    18
+    """
+    n = len(x0)
+    xs = x0.copy()
+    vs = np.zeros_like(xs)
+    buf = np.empty((n, n), dtype=xs.dtype) if n < RANK_MIN_BODIES else None
+    steps = 0
+    while True:
+        if buf is None:
+            _day12_update(xs[:, None], vs[:, None])
+        else:
+            # the pairwise kernel on one axis, without its 3-D bookkeeping
+            np.subtract(xs, xs[:, None], out=buf)
+            np.sign(buf, out=buf)
+            vs += buf.sum(axis=1)
+            xs += vs
+        steps += 1
+        if not vs.any() and (xs == x0).all():
+            return steps
+
+
+def day12_mod(inputs, parallel=True):
+    """
+    Period of the whole system: the lcm of the periods of the x, y and z
+    components, each found as an independent 1-D system, in a process of
+    its own if `parallel`
+
+    >>> day12_mod([[-1, 0, 2], [2, -10, -7], [4, -8, 8], [3, 5, -1]], parallel=False)
+    n = 4
+    component-0 step=18
+    component-1 step=28
+    component-2 step=44
+    2772
+    """
     n = len(inputs)
     print(f"n = {n}")
     xs = np.array(inputs)
-    vs = np.zeros(shape=(n, 3), dtype=np.int64)
 
-    xs_ini = copy.deepcopy(xs)
-    vs_ini = copy.deepcopy(vs)
-    periods = [0, 0, 0]
-    steps = 0
-
-    while not all(p > 0 for p in periods):
-        xs, vs = _day12_update(xs, vs)
-        steps += 1
-        for component in range(3):
-            if (
-                periods[component] == 0
-                and (xs_ini[:, component] == xs[:, component]).all()
-                and (vs_ini[:, component] == vs[:, component]).all()
-            ):
-                periods[component] = steps
-                print(f"component-{component} step={steps}")
+    if parallel:
+        with ProcessPoolExecutor(max_workers=xs.shape[1]) as pool:
+            periods = list(pool.map(_axis_period, xs.T))
+    else:
+        periods = [_axis_period(x0) for x0 in xs.T]
+    for component, steps in enumerate(periods):
+        print(f"component-{component} step={steps}")
 
     return lcm(periods)
 
@@ -1,144 +1,36 @@
+import os
 import sys
+import time
 import collections
-from typing import List, Tuple, Dict, DefaultDict
+import numpy as np
+from typing import List, Tuple, Dict, DefaultDict, Optional, Type
 from utils import get_path
+from intcode import IntcodeVM, Memory, Profile, Trace
+from intcode_store import load_checkpoint, load_program, save_checkpoint
+from raster import Board, TerminalView, output_block, rasterize
 
-Intcode = DefaultDict[int, int]
-Modes = Tuple[str, str, str]
+Intcode = Memory
 Position = Tuple[int, int]
 Facing = int
 
+# empty, wall, block, paddle, ball
+TILES = " #X-o"
+
 
 def day13_read():
     path = get_path(13)
-    intcode = collections.defaultdict(int)
-    xs = [int(x) for x in open(path).read().split(',')]
-    for i, x in enumerate(xs):
-        intcode[i] = x
-    return intcode
+    return load_program(path).memory()
 
 
 def intcomputer(
-    q_in: collections.deque, intcode: Intcode, loc=0, relbase=0, name="name", verbose=True
+    q_in: collections.deque, intcode: Intcode, loc=0, relbase=0, name="name", verbose=False
 ) -> (collections.deque, Intcode, int, int):
-    q_out = collections.deque()
-
-    def _decode_opcode(n: int) -> Tuple[int, Modes]:
-        op = n % 100  # take two right-most digits as int
-        s = str(n).zfill(5)
-        # '0' position mode, '1' immediate mode, '2': relative mode
-        modes = (s[2], s[1], s[0])
-        return op, modes
-
-    def _get_addr(xs: Intcode, loc: int, m: str, relbase: int) -> int:
-        if m == "0":
-            res = xs[loc]
-        elif m == "1":
-            res = loc
-        else:
-            assert m == "2"
-            res = relbase + xs[loc]
-        return res
-
-    def _bin_op(
-        f, xs: Intcode, loc: int, mode: Modes, relbase: int
-    ) -> Tuple[Intcode, int, int]:
-        left = _get_addr(xs, loc + 1, mode[0], relbase)
-        right = _get_addr(xs, loc + 2, mode[1], relbase)
-        target = _get_addr(xs, loc + 3, mode[2], relbase)
-        xs[target] = f(xs[left], xs[right])
-        return xs, loc + 4, relbase
-
-    def _add(
-        xs: Intcode, loc: int, mode: Modes, relbase: int
-    ) -> Tuple[Intcode, int, int]:
-        return _bin_op(lambda a, b: a + b, xs, loc, mode, relbase)
-
-    def _mul(
-        xs: Intcode, loc: int, mode: Modes, relbase: int
-    ) -> Tuple[Intcode, int, int]:
-        return _bin_op(lambda a, b: a * b, xs, loc, mode, relbase)
-
-    def _in(
-        xs: Intcode, loc: int, mode: Modes, relbase: int
-    ) -> Tuple[Intcode, int, int]:
-        target = _get_addr(xs, loc + 1, mode[0], relbase)
-        xs[target] = q_in.popleft()
-        return xs, loc + 2, relbase
-
-    def _out(
-        xs: Intcode, loc: int, mode: Modes, relbase: int
-    ) -> Tuple[Intcode, int, int]:
-        target = _get_addr(xs, loc + 1, mode[0], relbase)
-        q_out.append(xs[target])
-        return xs, loc + 2, relbase
-
-    def _jmp_true(
-        xs: Intcode, loc: int, mode: Modes, relbase: int
-    ) -> Tuple[Intcode, int]:
-        addr = _get_addr(xs, loc + 1, mode[0], relbase)
-        if xs[addr] > 0:
-            target = _get_addr(xs, loc + 2, mode[1], relbase)
-            loc = xs[target]
-        else:
-            loc += 3
-        return xs, loc, relbase
-
-    def _jmp_false(
-        xs: Intcode, loc: int, mode: Modes, relbase: int
-    ) -> Tuple[Intcode, int]:
-        addr = _get_addr(xs, loc + 1, mode[0], relbase)
-        if xs[addr] == 0:
-            target = _get_addr(xs, loc + 2, mode[1], relbase)
-            loc = xs[target]
-        else:
-            loc += 3
-        return xs, loc, relbase
-
-    def _lt(xs: Intcode, loc: int, mode: Modes, relbase: int) -> Tuple[Intcode, int]:
-        return _bin_op(lambda a, b: int(a < b), xs, loc, mode, relbase)
-
-    def _eq(xs: Intcode, loc: int, mode: Modes, relbase: int) -> Tuple[Intcode, int]:
-        return _bin_op(lambda a, b: int(a == b), xs, loc, mode, relbase)
-
-    def _adj_relbase(
-        xs: Intcode, loc: int, mode: Modes, relbase: int
-    ) -> Tuple[Intcode, int]:
-        addr = _get_addr(xs, loc + 1, mode[0], relbase)
-        inc = xs[addr]
-        return xs, loc + 2, relbase + inc
-
-    opfun = {
-        1: _add,
-        2: _mul,
-        3: _in,
-        4: _out,
-        5: _jmp_true,
-        6: _jmp_false,
-        7: _lt,
-        8: _eq,
-        9: _adj_relbase,
-    }
-
-    while intcode[loc] != 99:
-        if verbose:
-            print(
-                f"{name}: processing {intcode[loc]} at {loc} with relbase {relbase}",
-                file=sys.stderr,
-            )
-
-        opcode = intcode[loc]
-        op, mode = _decode_opcode(opcode)
-
-        if op == 3 and not q_in:
-            # if verbose:
-            print(f"exhausted qin and freezing... at loc={loc} with intcode[loc]={intcode[loc]}", file=sys.stderr)
-            break
-
-        f = opfun[op]
-        intcode, loc, relbase = f(intcode, loc, mode, relbase)
-
-    return q_out, intcode, loc, relbase
+    trace = Trace(name=name) if verbose else None
+    vm = IntcodeVM(intcode, loc, relbase, trace=trace)
+    vm.inputs = q_in
+    if not vm.run_until_input() and verbose:
+        print(f"exhausted qin and freezing... at loc={vm.loc} with intcode[loc]={vm.memory[vm.loc]}", file=sys.stderr)
+    return vm.drain_output(), vm.memory, vm.loc, vm.relbase
 
 
 def count_tiles(q: collections.deque):
@@ -152,44 +44,16 @@ def count_tiles(q: collections.deque):
 
 
 def day13():
-    inputs = day13_read()
-    q = collections.deque([])
-    q, _, _, _ = intcomputer(q, inputs, verbose=False)
-    print(count_tiles(q))
+    vm = IntcodeVM(day13_read(), columnar=True)
+    vm.run_until_input()
+    board = Board()
+    board.scatter(output_block(vm.drain_output(), 3))
+    print(board.count(2))
 
 
 def day13_draw_breakout(d: DefaultDict[Tuple[int, int], int]):
-    xmin = 1000000000
-    ymin = 1000000000
-    xmax = -xmin
-    ymax = -ymin
-    for (x, y) in d:
-        if (x, y) != (-1, 0):
-            xmin = min(x, xmin)
-            xmax = max(x, xmax)
-            ymin = min(y, ymin)
-            ymax = max(y, ymax)
-
-    score = d[(-1, 0)]
-
-    res = [[" "] * (xmax - xmin + 1) for _ in range(ymin, ymax + 1)]
-    for i, y in enumerate(range(ymin, ymax + 1)):
-        for j, x in enumerate(range(xmin, xmax +1)):
-            if x == -1: continue
-            if d[(x, y)] == 1:
-                res[i][j] = '#'
-            elif d[(x, y)] == 2:
-                res[i][j] = 'X'
-            elif d[(x, y)] == 3:
-                res[i][j] = '-'
-            elif d[(x, y)] == 4:
-                res[i][j] = 'o'
-
-    print(f"Score: {score}")
-    # revert y-dir
-    for xs in res:
-        line = "".join(xs)
-        print(line)
+    print(f"Score: {d[(-1, 0)]}")
+    rasterize(d, exclude=[(-1, 0)]).show(TILES)
 
 
 def day13_update_board(board: DefaultDict[Position, int], q: collections.deque):
@@ -201,24 +65,113 @@ def day13_update_board(board: DefaultDict[Position, int], q: collections.deque):
     return board
 
 
-def day13_part2():
-    intcode = day13_read()
-    intcode[0] = 2
-    q = collections.deque([])
-    loc, relbase = 0, 0
-    board = collections.defaultdict(int)
+def day13_part2(checkpoint=None, view: Optional[TerminalView] = None):
+    """
+    a/d ... move the paddle, u ... undo a move, c ... save to `checkpoint`
+    The game resumes from `checkpoint` if the file exists. With a
+    TerminalView only the changed tiles are redrawn after each move.
+    """
 
-    while True:
-        q, intcode, loc, relbase = intcomputer(q, intcode, loc, relbase, verbose=False)
-        board = day13_update_board(board, q)
-        day13_draw_breakout(board)
+    def draw(force=False):
+        if view is None:
+            day13_draw_breakout(board)
+        else:
+            score = f"Score: {board[(-1, 0)]}"
+            view.draw(board, TILES, exclude=[(-1, 0)], status=score, force=force)
+
+    board = collections.defaultdict(int)
+    if checkpoint and os.path.exists(checkpoint):
+        vm, meta = load_checkpoint(checkpoint)
+        for x, y, code in meta["board"]:
+            board[(x, y)] = code
+    else:
+        intcode = day13_read()
+        intcode[0] = 2
+        vm = IntcodeVM(intcode)
+    history = []  # (machine, board) before each move, for "u" to undo
+
+    halted = vm.run_until_input()
+    while not halted:
+        board = day13_update_board(board, vm.drain_output())
+        draw()
         c = input()
+        if c.startswith("u") and history:
+            vm, board = history.pop()
+            continue
+        if c.startswith("c") and checkpoint:
+            meta = {"board": [[x, y, code] for (x, y), code in board.items()]}
+            save_checkpoint(vm, checkpoint, meta)
+            continue
+        history.append((vm.fork(), board.copy()))
         if c.startswith("a"):
-            q.append(-1)
+            vm.feed([-1])
         elif c.startswith("d"):
-            q.append(1)
+            vm.feed([1])
         else:
-            q.append(0)
+            vm.feed([0])
+        halted = vm.run_until_input()
+
+    board = day13_update_board(board, vm.drain_output())
+    draw(force=True)
+    return board[(-1, 0)]
+
+
+def _last_x(block: np.ndarray, code: int, default: int) -> int:
+    xs = block[block[:, 2] == code, 0]
+    return int(xs[-1]) if len(xs) else default
+
+
+def _autoplay(vm: IntcodeVM) -> Tuple[int, int]:
+    """
+    Play to the end, keeping the paddle under the ball; (score, frames)
+    `vm` must collect columnar outputs.
+    """
+    score = frames = 0
+    ball = paddle = 0
+    while True:
+        halted = vm.run_until_input()
+        frames += 1
+        block = output_block(vm.drain_output(), 3)
+        is_score = (block[:, 0] == -1) & (block[:, 1] == 0)
+        if is_score.any():
+            score = int(block[is_score, 2][-1])
+        tiles = block[~is_score]
+        ball = _last_x(tiles, 4, ball)
+        paddle = _last_x(tiles, 3, paddle)
+        if halted:
+            return score, frames
+        vm.feed([(ball > paddle) - (ball < paddle)])
+
+
+def day13_autoplay(count=True, cls: Type[IntcodeVM] = IntcodeVM) -> Dict:
+    """
+    Play part 2 headless at full speed and report the final score,
+    frames per second and, with `count`, the instructions executed
+
+    The game is deterministic, so instructions are counted in a second,
+    profiled run and the timed run pays nothing for them.
+    """
+
+    def start(cls, **kwargs):
+        intcode = day13_read()
+        intcode[0] = 2  # free play
+        return cls(intcode, columnar=True, **kwargs)
+
+    t = time.perf_counter()
+    score, frames = _autoplay(start(cls))
+    elapsed = time.perf_counter() - t
+    stats = {"score": score, "frames": frames, "seconds": elapsed, "fps": frames / elapsed}
+    line = f"score {score}, {frames} frames in {elapsed:.3f} s ({stats['fps']:.0f} fps)"
+
+    if count:
+        profile = Profile()
+        _autoplay(start(IntcodeVM, profile=profile))
+        stats["instructions"] = profile.instructions
+        stats["ips"] = profile.instructions / elapsed
+        line += f", {profile.instructions} instructions ({stats['ips'] / 1e6:.2f} M/s)"
+    print(line)
+    return stats
+
 
 if __name__ == "__main__":
     day13_part2()
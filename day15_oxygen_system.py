@@ -1,6 +1,10 @@
 import collections
+import os
+from typing import Optional
 from utils import get_path
-from day13_care_package import intcomputer
+from intcode import IntcodeVM
+from intcode_store import load_checkpoint, load_program, save_checkpoint
+from raster import TerminalView, rasterize
 
 """
 Robot Exploration
@@ -93,7 +97,7 @@ class Brain(object):
 
 def day15_read():
     path = get_path(15)
-    return [int(x) for x in open(path).read().split(",")]
+    return load_program(path).memory()
 
 
 def update_pos(position, direction):
@@ -112,30 +116,13 @@ def update_pos(position, direction):
     return position
 
 
-def show(fieldmap, pos=None):
-    x_min = 100000000
-    y_min = 100000000
-    x_max = -100000000
-    y_max = -100000000
-
-    for (x, y) in fieldmap:
-        x_min = min(x_min, x)
-        y_min = min(y_min, y)
-        x_max = max(x_max, x)
-        y_max = max(y_max, y)
+# map characters, in raster code order; unexplored cells are blank
+MAP_CODES = " #.*+"
 
-    res = [[" "] * (x_max - x_min + 1) for _ in range(y_max - y_min + 1)]
-    for j in range(y_max - y_min + 1):
-        for i in range(x_max - x_min + 1):
-            x, y = i + x_min, j + y_min
-            if (x, y) in fieldmap:
-                res[j][i] = fieldmap[(x, y)]
 
-    if pos:
-        res[pos[1] - y_min][pos[0] - x_min] = "D"
-
-    for xs in res[::-1]:
-        print("".join(xs))
+def show(fieldmap, pos=None):
+    marks = {pos: "D"} if pos else None
+    rasterize(fieldmap, codes=MAP_CODES, flip_y=True).show(MAP_CODES, marks)
 
 
 def bfs(fieldmap):
@@ -203,16 +190,30 @@ def bfs(fieldmap):
 
 
 
-def day15_manual():
-    intcode = day15_read()
-    loc, relbase = 0, 0
-    q_in = collections.deque([])
+def day15_manual(checkpoint=None):
+    """
+    w/a/s/d ... move the droid, c ... save to `checkpoint`
+    The session resumes from `checkpoint` if the file exists.
+    """
+    if checkpoint and os.path.exists(checkpoint):
+        vm, meta = load_checkpoint(checkpoint)
+        position = tuple(meta["position"])
+        fieldmap = {(x, y): c for x, y, c in meta["fieldmap"]}
+    else:
+        vm = IntcodeVM(day15_read())
+        position = (0, 0)
+        fieldmap = {position: "+"}
 
-    position = (0, 0)
-    fieldmap = {position: "+"}
     while True:
         show(fieldmap, position)
         x = input()
+        if x.startswith("c") and checkpoint:
+            meta = {
+                "position": position,
+                "fieldmap": [[x, y, c] for (x, y), c in fieldmap.items()],
+            }
+            save_checkpoint(vm, checkpoint, meta)
+            continue
         if x.startswith("a"):
             dir_ = 3
         elif x.startswith("d"):
@@ -221,13 +222,11 @@ def day15_manual():
             dir_ = 2
         else:
             dir_ = 1
-        q_in.append(dir_)
+        vm.feed([dir_])
         next_position = update_pos(position, dir_)
 
-        q_out, intcode, loc, relbase = intcomputer(
-            q_in, intcode, loc, relbase, verbose=False
-        )
-        response = q_out.pop()
+        vm.run_until_input()
+        response = vm.drain_output().pop()
         if response == 2:
             position = next_position
             fieldmap[position] = "*"
@@ -247,9 +246,12 @@ def day15_manual():
     return cnt
 
 
-def day15_auto():
-    intcode = day15_read()
-    loc, relbase = 0, 0
+def day15_auto(view: Optional[TerminalView] = None, verbose=False):
+    """
+    Explore the whole map with the Brain; pass a TerminalView to watch
+    the droid while it moves
+    """
+    vm = IntcodeVM(day15_read())
 
     position = (0, 0)
     fieldmap = {position: "+"}
@@ -257,15 +259,16 @@ def day15_auto():
     brain = Brain()
 
     while True:
-        show(fieldmap, position)
+        if view is not None:
+            view.draw(fieldmap, MAP_CODES, MAP_CODES, {position: "D"}, flip_y=True)
         q_in, next_position = brain.command()
         if q_in is None:
             break
-        print(f"q_in = {q_in}, next_position = {next_position}")
-        q_out, intcode, loc, relbase = intcomputer(
-            q_in, intcode, loc, relbase, verbose=False
-        )
-        response = q_out.pop()
+        if verbose:
+            print(f"q_in = {q_in}, next_position = {next_position}")
+        vm.feed(q_in)
+        vm.run_until_input()
+        response = vm.drain_output().pop()
         brain.report(response)
         if response == 2:
             position = next_position
@@ -278,8 +281,12 @@ def day15_auto():
             assert response == 0
             fieldmap[next_position] = "#"
 
-    show(fieldmap)
-    print(fieldmap)
+    if view is not None:
+        view.draw(fieldmap, MAP_CODES, MAP_CODES, flip_y=True, force=True)
+    else:
+        show(fieldmap)
+    if verbose:
+        print(fieldmap)
     assert brain.fieldmap == fieldmap
 
     cnt = bfs(fieldmap)
@@ -287,6 +294,34 @@ def day15_auto():
     return cnt
 
 
+def day15_explore():
+    """
+    Breadth-first exploration by forking the droid's machine at every
+    open cell, instead of walking the droid back to a base camp
+    """
+    fieldmap = {(0, 0): "+"}
+    q = collections.deque([((0, 0), IntcodeVM(day15_read()))])
+    while q:
+        position, vm = q.popleft()
+        for dir_ in (1, 2, 3, 4):
+            next_position = update_pos(position, dir_)
+            if next_position in fieldmap:
+                continue
+            droid = vm.fork()
+            droid.feed([dir_])
+            droid.run_until_input()
+            response = droid.drain_output().pop()
+            if response == 0:
+                fieldmap[next_position] = "#"
+            else:
+                fieldmap[next_position] = "*" if response == 2 else "."
+                q.append((next_position, droid))
+
+    cnt = bfs(fieldmap)
+    print(f"Steps to fill with the oxigen: {cnt}")
+    return cnt
+
+
 if __name__ == "__main__":
     print(day15_auto())
     # print(day15_manual())
@@ -0,0 +1,771 @@
+"""
+Shared Intcode machinery
+
+Opcode dispatch
+Every raw opcode value (e.g. 1002, 21101) is mapped once per process to a
+handler that is already specialized for its parameter modes, so the
+interpreter loops never touch the decimal digits of an opcode.
+
+    '0' position mode, '1' immediate mode, '2' relative mode
+
+Handlers of the compute instructions (1, 2, 5, 6, 7, 8, 9) take
+(xs, loc, relbase) and return the next (loc, relbase).
+Input (3) takes (xs, loc, relbase, value) and returns (loc, relbase).
+Output (4) takes (xs, loc, relbase) and returns (value, loc, relbase).
+Halt (99) has no handler.
+
+Memory
+Handlers index memory directly, so they run against the plain list inside
+Memory. An IndexError means the instruction touched an address past the
+end; the interpreters then replay it against the Memory object itself,
+which reads zeros there and grows on writes. Replaying is safe because a
+handler writes at most once, after all of its reads. Handlers check the
+addresses they compute, and jumps, for values below 0 and raise
+IndexError too; the replay then fails the same way.
+
+Tracing
+Untraced loops look handlers up in DISPATCH and pay nothing for tracing.
+A Trace carries its own copy of the table whose handlers first record
+(pc, opcode, relbase) into a fixed-size ring buffer; loops switch tables
+once, before they start. An instruction replayed on Memory is recorded
+twice.
+
+"""
+import array
+import asyncio
+import collections
+import copy
+import functools
+import itertools as it
+import json
+import sys
+import textwrap
+import time
+from typing import Callable, Dict, Generator, Iterable, Optional, Tuple, Union
+
+Handler = Callable
+Entry = Tuple[int, Optional[Handler]]
+Outputs = Union[collections.deque, array.array]
+
+# Templates of parameters read as values, and of write targets (addresses).
+# Lists take negative indices from the end, so addresses are checked.
+_TARGET = {
+    0: "a{k} if (a{k} := xs[loc + {k}]) >= 0 else _negative(a{k})",
+    2: "a{k} if (a{k} := relbase + xs[loc + {k}]) >= 0 else _negative(a{k})",
+}
+_PARAM = {
+    0: "xs[" + _TARGET[0] + "]",
+    1: "xs[loc + {k}]",
+    2: "xs[" + _TARGET[2] + "]",
+}
+_JUMP = "(j if (j := {p2}) >= 0 else _negative(j))"
+
+# Instruction templates keyed by op: (number of params, body).
+# {p1}, {p2} are parameters read as values, {t1}, {t3} are write targets.
+_BODY = {
+    1: (3, "xs[{t3}] = {p1} + {p2}\n    return loc + 4, relbase"),
+    2: (3, "xs[{t3}] = {p1} * {p2}\n    return loc + 4, relbase"),
+    3: (1, "xs[{t1}] = value\n    return loc + 2, relbase"),
+    4: (1, "return {p1}, loc + 2, relbase"),
+    5: (2, "if {p1}:\n        return " + _JUMP + ", relbase\n    return loc + 3, relbase"),
+    6: (2, "if {p1}:\n        return loc + 3, relbase\n    return " + _JUMP + ", relbase"),
+    7: (3, "xs[{t3}] = 1 if {p1} < {p2} else 0\n    return loc + 4, relbase"),
+    8: (3, "xs[{t3}] = 1 if {p1} == {p2} else 0\n    return loc + 4, relbase"),
+    9: (1, "return loc + 2, relbase + {p1}"),
+}
+
+# Parameters that are written to accept position and relative modes only.
+_WRITES = {1: 3, 2: 3, 3: 1, 7: 3, 8: 3}
+
+# Instructions inside a superinstruction advance loc instead of returning.
+_STEP = {
+    1: "xs[{t3}] = {p1} + {p2}\nloc += 4",
+    2: "xs[{t3}] = {p1} * {p2}\nloc += 4",
+    7: "xs[{t3}] = 1 if {p1} < {p2} else 0\nloc += 4",
+    8: "xs[{t3}] = 1 if {p1} == {p2} else 0\nloc += 4",
+    9: "relbase += {p1}\nloc += 2",
+}
+
+
+def encode_opcode(op: int, modes: Tuple[int, ...]) -> int:
+    """
+    >>> encode_opcode(2, (0, 1, 0))
+    1002
+    >>> encode_opcode(1, (1, 1, 2))
+    21101
+    """
+    return op + sum(m * 10 ** (k + 2) for k, m in enumerate(modes))
+
+
+def _negative(addr: int):
+    raise IndexError(f"negative address {addr}")
+
+
+def _fields(modes: Tuple[int, ...]) -> Dict[str, str]:
+    fields = {}
+    for k, m in enumerate(modes, 1):
+        fields[f"p{k}"] = _PARAM[m].format(k=k)
+        if m in _TARGET:
+            fields[f"t{k}"] = _TARGET[m].format(k=k)
+    return fields
+
+
+def _split_opcode(opcode: int) -> Tuple[int, Tuple[int, ...]]:
+    op = opcode % 100
+    nparams = _BODY[op][0] if op in _BODY else 0
+    return op, tuple(opcode // 10 ** (k + 2) % 10 for k in range(nparams))
+
+
+def _make_handler(op: int, modes: Tuple[int, ...]) -> Handler:
+    _, body = _BODY[op]
+    fields = _fields(modes)
+    args = "xs, loc, relbase, value" if op == 3 else "xs, loc, relbase"
+    name = f"_op{encode_opcode(op, modes)}"
+    src = f"def {name}({args}):\n    {body.format(**fields)}\n"
+    namespace = {"_negative": _negative}
+    exec(compile(src, f"<intcode {name}>", "exec"), namespace)
+    return namespace[name]
+
+
+def _build_dispatch() -> Dict[int, Entry]:
+    table = {99: (99, None)}
+    for op, (nparams, _) in _BODY.items():
+        choices = [(0, 1, 2)] * nparams
+        if op in _WRITES:
+            choices[_WRITES[op] - 1] = (0, 2)
+        for modes in it.product(*choices):
+            table[encode_opcode(op, modes)] = (op, _make_handler(op, modes))
+    return table
+
+
+DISPATCH = _build_dispatch()
+
+_FUSED: Dict[Tuple[int, ...], Handler] = {}
+
+
+def _make_fused(chain: Tuple[int, ...]) -> Handler:
+    """
+    Superinstruction running `chain` of raw opcodes in one dispatch
+
+    Each instruction after the first checks that its opcode is still the
+    expected one, and returns to the interpreter loop otherwise. If it
+    raises IndexError it has not written anything yet, so it also hands
+    back to the loop, which executes it on its own.
+    """
+    if chain in _FUSED:
+        return _FUSED[chain]
+    lines = []
+    for i, opcode in enumerate(chain):
+        op, modes = _split_opcode(opcode)
+        last = i == len(chain) - 1
+        body = "    " + _BODY[op][1] if last else _STEP[op]
+        body = textwrap.dedent(body.format(**_fields(modes)))
+        if i == 0:
+            lines.append(textwrap.indent(body, "    "))
+            continue
+        lines += [
+            "    try:",
+            f"        if xs[loc] != {opcode}:",
+            "            return loc, relbase",
+            textwrap.indent(body, "        "),
+            "    except IndexError:",
+            "        return loc, relbase",
+        ]
+    name = "_fused_" + "_".join(map(str, chain))
+    src = f"def {name}(xs, loc, relbase):\n" + "\n".join(lines) + "\n"
+    namespace = {"_negative": _negative}
+    exec(compile(src, f"<intcode {name}>", "exec"), namespace)
+    handler = _FUSED[chain] = namespace[name]
+    return handler
+
+
+@functools.lru_cache(maxsize=64)
+def _fuse(program: Tuple[int, ...], max_len: int) -> Dict[int, Entry]:
+    # linear sweep; words that do not decode are taken as data
+    runs = [[]]
+    loc = 0
+    while loc < len(program):
+        opcode = program[loc]
+        if opcode in DISPATCH and opcode != 99:
+            runs[-1].append(opcode)
+            loc += _BODY[opcode % 100][0] + 1
+        else:
+            runs.append([])
+            loc += 1
+
+    follows = collections.defaultdict(collections.Counter)
+    for run in runs:
+        for n in range(2, max_len + 1):
+            for i in range(len(run) - n + 1):
+                follows[tuple(run[i : i + n - 1])][run[i + n - 1]] += 1
+
+    table = dict(DISPATCH)
+    for opcode, (op, _) in DISPATCH.items():
+        if op not in _STEP:
+            continue
+        chain = (opcode,)
+        while len(chain) < max_len and chain[-1] % 100 in _STEP:
+            nexts = [
+                (n, c) for c, n in follows[chain].items() if c % 100 in _STEP or c % 100 in (5, 6)
+            ]
+            if not nexts:
+                break
+            chain += (max(nexts)[1],)
+        if len(chain) > 1:
+            table[opcode] = (op, _make_fused(chain))
+    return table
+
+
+def fuse(program: Iterable[int], max_len: int = 3) -> Dict[int, Entry]:
+    """
+    DISPATCH with superinstructions for the program's frequent sequences
+
+    A linear sweep over the program counts which instruction follows which.
+    Each computing opcode then dispatches to a superinstruction running it
+    together with its most frequent successors, e.g. a compare followed by
+    a conditional jump, or adj_relbase followed by a relative-mode store.
+    The successors' opcodes are checked at run time, so a modified program
+    falls back to single dispatches.
+
+    >>> table = fuse([1007, 9, 5, 10, 1005, 10, 0, 99, 0, 3, 0])
+    >>> table[1007][1].__name__
+    '_fused_1007_1005'
+    >>> xs = [1007, 9, 5, 10, 1005, 10, 0, 99, 0, 3, 0]
+    >>> table[1007][1](xs, 0, 0)
+    (0, 0)
+    """
+    xs = program.data if isinstance(program, Memory) else program
+    return _fuse(tuple(xs), max_len)
+
+
+def decode(n: int) -> Entry:
+    """
+    Look up (op, handler) of a raw opcode value
+
+    >>> decode(1002)[0]
+    2
+    >>> decode(99)
+    (99, None)
+
+    The run loops fall back to it on opcodes missing from their tables:
+
+    >>> IntcodeVM([1101, 0, 55, 4, 0]).run_until_input()
+    Traceback (most recent call last):
+    ...
+    ValueError: Invalid opcode: 55
+    """
+    try:
+        return DISPATCH[n]
+    except KeyError:
+        raise ValueError(f"Invalid opcode: {n}") from None
+
+
+class Trace(object):
+    """
+    Ring buffer of the last executed instructions as (pc, opcode, relbase)
+
+    >>> trace = Trace(size=2)
+    >>> vm = IntcodeVM([1101, 1, 2, 9, 109, 3, 204, 6, 99, 0], trace=trace)
+    >>> vm.run_until_input()
+    True
+    >>> list(trace.records)
+    [(4, 109, 0), (6, 204, 3)]
+    """
+
+    def __init__(self, size: int = 1000, name: str = "name"):
+        self.name = name
+        self.records = collections.deque(maxlen=size)
+        self.dispatch = self.wrap(DISPATCH)
+
+    def wrap(self, table: Dict[int, Entry]) -> Dict[int, Entry]:
+        return {opcode: (op, self._wrap(opcode, f)) for opcode, (op, f) in table.items()}
+
+    def _wrap(self, opcode: int, f: Optional[Handler]) -> Optional[Handler]:
+        if f is None:
+            return None
+        record = self.records.append
+
+        def traced(xs, loc, relbase, *args):
+            record((loc, opcode, relbase))
+            return f(xs, loc, relbase, *args)
+
+        return traced
+
+    def dump(self, file=sys.stderr):
+        for loc, opcode, relbase in self.records:
+            print(
+                f"{self.name}: processing {opcode} at {loc} with relbase {relbase}",
+                file=file,
+            )
+
+
+def _accesses(opcode: int) -> Tuple[int, int]:
+    """
+    Data reads and writes of an instruction, excluding a jump target
+
+    >>> _accesses(1002)
+    (1, 1)
+    >>> _accesses(2105)
+    (0, 0)
+    """
+    op = opcode % 100
+    if op == 99:
+        return 0, 0
+    nparams, _ = _BODY[op]
+    modes = [opcode // 10 ** (k + 2) % 10 for k in range(nparams)]
+    written = _WRITES.get(op)
+    if op in (5, 6):
+        modes = modes[:1]
+    reads = sum(1 for k, m in enumerate(modes, 1) if m != 1 and k != written)
+    return reads, int(written is not None)
+
+
+class Profile(object):
+    """
+    Opt-in counters of an IntcodeVM run
+
+    Counts executed instructions per (pc, opcode), data reads and writes
+    of memory, and the wall time of every wait for input, i.e. from the
+    machine blocking on an empty input queue until it is resumed. Like
+    Trace, an instruction replayed on Memory is counted twice.
+
+    >>> profile = Profile()
+    >>> vm = IntcodeVM([1101, 0, 3, 12, 1001, 12, -1, 12, 1005, 12, 4, 99, 0], profile=profile)
+    >>> vm.run_until_input()
+    True
+    >>> profile.instructions
+    8
+    >>> profile.summary()["opcodes"]
+    {'1101': 1, '1001': 3, '1005': 3, '99': 1}
+    >>> profile.reads, profile.writes
+    (6, 4)
+    """
+
+    def __init__(self):
+        self.hits = collections.Counter()  # (pc, opcode) -> executions
+        self.jumps = collections.Counter()  # (pc, opcode) -> taken jumps
+        self.io_waits = []  # (pc, seconds)
+        self._blocked = None
+
+    def wrap(self, table: Dict[int, Entry]) -> Dict[int, Entry]:
+        return {opcode: (op, self._wrap(opcode, op, f)) for opcode, (op, f) in table.items()}
+
+    def _wrap(self, opcode: int, op: int, f: Optional[Handler]) -> Optional[Handler]:
+        hits = self.hits
+        if f is None:
+            return None
+        if op in (5, 6):
+            jumps = self.jumps
+
+            def profiled(xs, loc, relbase):
+                hits[(loc, opcode)] += 1
+                res = f(xs, loc, relbase)
+                if res[0] != loc + 3:
+                    jumps[(loc, opcode)] += 1
+                return res
+
+            return profiled
+
+        def profiled(xs, loc, relbase, *args):
+            hits[(loc, opcode)] += 1
+            return f(xs, loc, relbase, *args)
+
+        return profiled
+
+    def halt(self, loc: int):
+        self.hits[(loc, 99)] += 1
+
+    def block(self, loc: int):
+        self._blocked = (loc, time.perf_counter())
+
+    def resume(self):
+        if self._blocked is not None:
+            loc, start = self._blocked
+            self.io_waits.append((loc, time.perf_counter() - start))
+            self._blocked = None
+
+    @property
+    def instructions(self) -> int:
+        return sum(self.hits.values())
+
+    @property
+    def reads(self) -> int:
+        res = sum(n * _accesses(opcode)[0] for (_, opcode), n in self.hits.items())
+        # a taken jump also reads its target parameter
+        res += sum(
+            n for (_, opcode), n in self.jumps.items() if opcode // 1000 % 10 != 1
+        )
+        return res
+
+    @property
+    def writes(self) -> int:
+        return sum(n * _accesses(opcode)[1] for (_, opcode), n in self.hits.items())
+
+    def summary(self) -> Dict:
+        opcodes = collections.Counter()
+        pcs = collections.Counter()
+        for (loc, opcode), n in self.hits.items():
+            opcodes[str(opcode)] += n
+            pcs[str(loc)] += n
+        return {
+            "instructions": self.instructions,
+            "reads": self.reads,
+            "writes": self.writes,
+            "opcodes": dict(opcodes),
+            "pcs": dict(pcs),
+            "io_waits": [[loc, sec] for loc, sec in self.io_waits],
+        }
+
+    def to_json(self, **kwargs) -> str:
+        return json.dumps(self.summary(), **kwargs)
+
+    def report(self, top: int = 20) -> str:
+        waited = [sec for _, sec in self.io_waits]
+        lines = [
+            f"instructions: {self.instructions}",
+            f"memory reads: {self.reads}, writes: {self.writes}",
+            f"input waits: {len(waited)}, total {sum(waited):.6f} s, max {max(waited, default=0):.6f} s",
+            "",
+            f"{'opcode':>8} {'count':>12}",
+        ]
+        opcodes = collections.Counter()
+        for (_, opcode), n in self.hits.items():
+            opcodes[opcode] += n
+        for opcode, n in opcodes.most_common():
+            lines.append(f"{opcode:>8} {n:>12}")
+        lines += ["", f"{'pc':>8} {'opcode':>8} {'count':>12}"]
+        for (loc, opcode), n in self.hits.most_common(top):
+            lines.append(f"{loc:>8} {opcode:>8} {n:>12}")
+        return "\n".join(lines)
+
+
+class _Halted(object):
+    def __repr__(self):
+        return "HALTED"
+
+
+# End of stream: put on an output queue by a machine after its last value,
+# so that readers stop as soon as it halts instead of waiting on a timeout.
+HALTED = _Halted()
+
+
+class Memory(object):
+    """
+    Contiguous Intcode memory
+
+    >>> mem = Memory([104, 1125899906842624, 99])
+    >>> mem[1], mem[1000], len(mem)
+    (1125899906842624, 0, 3)
+    >>> mem[10] = 7
+    >>> mem[10], len(mem)
+    (7, 11)
+    >>> mem[-1]
+    Traceback (most recent call last):
+    ...
+    IndexError: negative address -1
+
+    fork() shares the underlying list until one side is written:
+
+    >>> other = mem.fork()
+    >>> other.data is mem.data
+    True
+    >>> other[0] = 4
+    >>> mem[0], other[0]
+    (104, 4)
+    """
+
+    __slots__ = ("data", "_owners")
+
+    def __init__(self, values: Iterable[int] = ()):
+        self.data = list(values)
+        self._owners = [1]  # shared by every Memory holding the same list
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    def __iter__(self):
+        return iter(self.data)
+
+    def __getitem__(self, addr: int) -> int:
+        if addr < 0:
+            raise IndexError(f"negative address {addr}")
+        try:
+            return self.data[addr]
+        except IndexError:
+            return 0
+
+    def __setitem__(self, addr: int, value: int):
+        if addr < 0:
+            raise IndexError(f"negative address {addr}")
+        if self._owners[0] > 1:
+            self.unshare()
+        try:
+            self.data[addr] = value
+        except IndexError:
+            size = len(self.data)
+            self.data.extend([0] * max(addr + 1 - size, size))
+            self.data[addr] = value
+
+    def fork(self) -> "Memory":
+        other = Memory.__new__(Memory)
+        other.data = self.data
+        other._owners = self._owners
+        self._owners[0] += 1
+        return other
+
+    def unshare(self):
+        """Take a private copy of the list if it is shared with a fork"""
+        if self._owners[0] > 1:
+            self._owners[0] -= 1
+            self.data = list(self.data)
+            self._owners = [1]
+
+
+class IntcodeVM(object):
+    """
+    Resumable Intcode machine
+
+    Memory, program counter and relative base persist across calls, so an
+    interactive driver only feeds inputs and drains outputs between runs.
+
+    >>> vm = IntcodeVM([3, 9, 8, 9, 10, 9, 4, 9, 99, -1, 8])
+    >>> vm.run_until_input()
+    False
+    >>> vm.feed([8])
+    >>> vm.run_until_input()
+    True
+    >>> vm.drain_output()
+    deque([1])
+
+    With columnar=True outputs are collected in an int64 array.array,
+    which bulk consumers view as rows without decoding values one by one,
+    e.g. np.frombuffer(out, np.int64).reshape(-1, 3). Output values must
+    then fit 64 bits, and coroutine() is not available.
+
+    >>> vm = IntcodeVM([104, 1, 104, 2, 104, 3, 99], columnar=True)
+    >>> vm.run_until_input(), vm.drain_output()
+    (True, array('q', [1, 2, 3]))
+    """
+
+    def __init__(
+        self,
+        program: Iterable[int],
+        loc: int = 0,
+        relbase: int = 0,
+        trace: Optional[Trace] = None,
+        profile: Optional[Profile] = None,
+        fused: bool = True,
+        columnar: bool = False,
+    ):
+        self.memory = program if isinstance(program, Memory) else Memory(program)
+        self.loc = loc
+        self.relbase = relbase
+        self.trace = trace
+        self.profile = profile
+        # superinstructions would hide instructions from trace and profile
+        fused = fused and trace is None and profile is None
+        # step() executes exactly one instruction, so it never runs fused
+        self.single = DISPATCH
+        if trace is not None:
+            self.single = trace.dispatch
+        if profile is not None:
+            self.single = profile.wrap(self.single)
+        self.dispatch = fuse(self.memory) if fused else self.single
+        self.inputs = collections.deque()
+        self.columnar = columnar
+        self.outputs = self._new_outputs()
+        self.halted = False
+
+    def _new_outputs(self) -> Outputs:
+        return array.array("q") if self.columnar else collections.deque()
+
+    def feed(self, values: Iterable[int]):
+        self.inputs.extend(values)
+
+    def drain_output(self) -> Outputs:
+        out, self.outputs = self.outputs, self._new_outputs()
+        return out
+
+    def step(self) -> bool:
+        """
+        Execute one instruction; False if halted or waiting for input
+
+        >>> vm = IntcodeVM([1007, 9, 5, 10, 1005, 10, 0, 99, 0, 3, 0])
+        >>> vm.step(), vm.loc
+        (True, 4)
+        """
+        mem = self.memory
+        mem.unshare()
+        try:
+            op, f = self.single[mem[self.loc]]
+        except KeyError:
+            op, f = decode(mem[self.loc])
+        if op == 99:
+            self.halted = True
+            return False
+        if op == 3:
+            if not self.inputs:
+                return False
+            self.loc, self.relbase = f(mem, self.loc, self.relbase, self.inputs.popleft())
+        elif op == 4:
+            out, self.loc, self.relbase = f(mem, self.loc, self.relbase)
+            self.outputs.append(out)
+        else:
+            self.loc, self.relbase = f(mem, self.loc, self.relbase)
+        return True
+
+    def run_until_input(self, max_outputs: Optional[int] = None) -> bool:
+        """
+        Run until an input is needed and none is queued; True if halted
+
+        With `max_outputs` the machine also stops right after an output
+        once that many outputs are queued:
+
+        >>> vm = IntcodeVM([104, 7, 1105, 1, 0])
+        >>> vm.run_until_input(max_outputs=3), vm.drain_output(), vm.loc
+        (False, deque([7, 7, 7]), 2)
+
+        Addresses below 0 and jumps past the end of memory are errors:
+
+        >>> IntcodeVM([109, -1, 21101, 5, 5, 0, 104, 7, 99, 0]).run_until_input()
+        Traceback (most recent call last):
+        ...
+        IndexError: negative address -1
+        >>> IntcodeVM([1105, 1, -3, 99]).run_until_input()
+        Traceback (most recent call last):
+        ...
+        IndexError: negative address -3
+        >>> IntcodeVM([1105, 1, 100]).run_until_input()
+        Traceback (most recent call last):
+        ...
+        ValueError: Invalid opcode: 0
+        """
+        mem = self.memory
+        mem.unshare()
+        xs = mem.data
+        dispatch = self.dispatch
+        inputs = self.inputs
+        outputs = self.outputs
+        limit = sys.maxsize if max_outputs is None else max_outputs
+        loc, relbase = self.loc, self.relbase
+        if self.profile is not None:
+            self.profile.resume()
+        try:
+            while True:
+                try:
+                    op, f = dispatch[xs[loc]]
+                except (KeyError, IndexError):
+                    op, f = decode(mem[loc])
+                try:
+                    if op == 3:
+                        if not inputs:
+                            break
+                        value = inputs.popleft()
+                        loc, relbase = f(xs, loc, relbase, value)
+                    elif op == 4:
+                        out, loc, relbase = f(xs, loc, relbase)
+                        outputs.append(out)
+                        if len(outputs) >= limit:
+                            break
+                    elif op == 99:
+                        self.halted = True
+                        break
+                    else:
+                        loc, relbase = f(xs, loc, relbase)
+                except IndexError:
+                    # past the end of memory; replay on Memory to read zeros and grow
+                    if op == 3:
+                        loc, relbase = f(mem, loc, relbase, value)
+                    elif op == 4:
+                        out, loc, relbase = f(mem, loc, relbase)
+                        outputs.append(out)
+                        if len(outputs) >= limit:
+                            break
+                    else:
+                        loc, relbase = f(mem, loc, relbase)
+        except Exception:
+            if self.trace is not None:
+                self.trace.dump()
+            raise
+        finally:
+            self.loc, self.relbase = loc, relbase
+        if self.profile is not None:
+            if self.halted:
+                self.profile.halt(loc)
+            else:
+                self.profile.block(loc)
+        if self.halted and self.trace is not None:
+            self.trace.dump()
+        return self.halted
+
+    def fork(self) -> "IntcodeVM":
+        """
+        Clone the machine, including queued inputs and undrained outputs
+
+        Both machines share memory until either of them runs or is written
+        to. Handlers run on the plain list, so sharing is per whole memory
+        rather than per page.
+
+        >>> vm = IntcodeVM([3, 9, 8, 9, 10, 9, 4, 9, 99, -1, 8])
+        >>> vm.run_until_input()
+        False
+        >>> other = vm.fork()
+        >>> vm.feed([8]); other.feed([7])
+        >>> vm.run_until_input(), other.run_until_input()
+        (True, True)
+        >>> vm.drain_output(), other.drain_output()
+        (deque([1]), deque([0]))
+        """
+        other = copy.copy(self)
+        other.memory = self.memory.fork()
+        other.inputs = collections.deque(self.inputs)
+        other.outputs = copy.copy(self.outputs)
+        return other
+
+    def coroutine(self) -> Generator[Optional[int], int, None]:
+        """
+        Drive the machine as a plain generator, without an event loop
+
+        Yields every output value, and yields None when an input is needed;
+        the input is then passed in with send(). Returns on halt.
+
+        >>> g = IntcodeVM([3, 9, 8, 9, 10, 9, 4, 9, 99, -1, 8]).coroutine()
+        >>> next(g) is None
+        True
+        >>> g.send(8)
+        1
+        """
+        if self.columnar:
+            raise ValueError("coroutine() needs a machine without columnar outputs")
+        while True:
+            halted = self.run_until_input()
+            while self.outputs:
+                yield self.outputs.popleft()
+            if halted:
+                return
+            self.inputs.append((yield None))
+
+    async def serve(self, q_in: asyncio.Queue, q_out: asyncio.Queue):
+        """
+        Run against asyncio queues until the machine halts
+
+        Outputs are put on `q_out` whenever the machine stops, and each
+        input it needs is awaited on `q_in`.
+
+        >>> async def compare(x):
+        ...     q_in, q_out = asyncio.Queue(), asyncio.Queue()
+        ...     q_in.put_nowait(x)
+        ...     await IntcodeVM([3, 9, 8, 9, 10, 9, 4, 9, 99, -1, 8]).serve(q_in, q_out)
+        ...     return q_out.get_nowait()
+        >>> asyncio.run(compare(8)), asyncio.run(compare(7))
+        (1, 0)
+        """
+        if self.columnar:
+            raise ValueError("serve() needs a machine without columnar outputs")
+        while True:
+            halted = self.run_until_input()
+            while self.outputs:
+                await q_out.put(self.outputs.popleft())
+            if halted:
+                return
+            self.inputs.append(await q_in.get())
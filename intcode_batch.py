@@ -0,0 +1,328 @@
+"""
+Lockstep execution of many copies of one Intcode program
+
+A BatchVM holds N machines ("lanes") as one (N, M) int64 memory array
+with per-lane pc and relative base. Each round fetches the opcode of
+every lane that can run and executes each distinct raw opcode as one
+vectorized step over the lanes that share it. Lanes usually share their
+pc, e.g. the same program on different inputs, so a round is typically
+a single step over all of them. Lanes whose control flow has diverged
+are grouped by opcode and still run vectorized.
+
+Inputs and outputs are per-lane queues kept as arrays, so feeding a
+column of inputs or reading a column of outputs is vectorized as well.
+
+Scalar fallback
+A lane leaves the batch for a scalar IntcodeVM when it would address
+memory outside [0, max_memory) or when an add or a multiply could
+overflow int64. The IntcodeVM continues from the lane's exact state with
+unbounded ints, so every lane computes what a plain IntcodeVM would.
+Lanes that hit an invalid opcode stop and are marked in `faulted`,
+instead of raising, so a sweep over garbage inputs finishes.
+
+"""
+import itertools as it
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from intcode import IntcodeVM, Memory
+
+_NPARAMS = {1: 3, 2: 3, 3: 1, 4: 1, 5: 2, 6: 2, 7: 3, 8: 3, 9: 1, 99: 0}
+_WRITES = {1: 3, 2: 3, 3: 1, 7: 3, 8: 3}
+
+# operands at or above this may overflow int64 when added or multiplied
+_SAFE = float(2 ** 62)
+
+
+def _decode(opcode: int) -> Optional[Tuple[int, List[int]]]:
+    op = opcode % 100
+    n = _NPARAMS.get(op)
+    if n is None or opcode < 0:
+        return None
+    modes = [opcode // 10 ** (k + 2) % 10 for k in range(n)]
+    if opcode >= 10 ** (n + 2) or any(m > 2 for m in modes):
+        return None
+    if op in _WRITES and modes[_WRITES[op] - 1] == 1:
+        return None
+    return op, modes
+
+
+class BatchVM(object):
+    """
+    N copies of a program run in lockstep
+
+    >>> prog = [3, 9, 8, 9, 10, 9, 4, 9, 99, -1, 8]  # is the input 8?
+    >>> vm = BatchVM(prog, 4)
+    >>> vm.feed([7, 8, 9, 8])
+    >>> vm.run()
+    >>> out, counts = vm.drain_output()
+    >>> out[:, 0].tolist(), counts.tolist(), vm.halted.tolist()
+    ([0, 1, 0, 1], [1, 1, 1, 1], [True, True, True, True])
+
+    Lanes that would overflow int64 carry on as scalar machines:
+
+    >>> vm = BatchVM([3, 11, 1002, 11, 1000000000000, 11, 4, 11, 99, 0, 0, 0], 2)
+    >>> vm.feed([1, 10 ** 12])
+    >>> vm.run()
+    >>> sorted(vm.scalar), vm.column(11).tolist()
+    ([1], [1000000000000, 1000000000000000000000000])
+
+    Memory grows past the program as in IntcodeVM:
+
+    >>> quine = [109, 1, 204, -1, 1001, 100, 1, 100, 1008, 100, 16, 101, 1006, 101, 0, 99]
+    >>> vm = BatchVM(quine, 2)
+    >>> vm.run()
+    >>> out, counts = vm.drain_output()
+    >>> scalar = IntcodeVM(quine)
+    >>> scalar.run_until_input()
+    True
+    >>> out[1].tolist() == list(scalar.drain_output()) == quine, counts.tolist()
+    (True, [16, 16])
+    >>> vm = BatchVM([1, 100, 0, 0, 4, 0, 99], 1)
+    >>> vm.run()
+    >>> scalar = IntcodeVM([1, 100, 0, 0, 4, 0, 99])
+    >>> scalar.run_until_input()
+    True
+    >>> vm.drain_output()[0].tolist(), scalar.drain_output()
+    ([[1]], deque([1]))
+
+    Scalar lanes that hit an invalid opcode are marked faulted as well:
+
+    >>> vm = BatchVM([1101, 0, 0, 70000, 55], 2)
+    >>> vm.run()
+    >>> sorted(vm.scalar), vm.faulted.tolist(), vm.halted.tolist()
+    ([0, 1], [True, True], [False, False])
+    """
+
+    def __init__(self, program: Sequence[int], n: int, max_memory: int = 1 << 16):
+        prog = np.asarray(list(program), dtype=np.int64)
+        self.n = n
+        self.max_memory = max_memory
+        self.mem = np.tile(prog, (n, 1))
+        self.pc = np.zeros(n, dtype=np.int64)
+        self.relbase = np.zeros(n, dtype=np.int64)
+        self.halted = np.zeros(n, dtype=bool)
+        self.faulted = np.zeros(n, dtype=bool)
+        self.diverged = np.zeros(n, dtype=bool)
+        self.scalar: Dict[int, IntcodeVM] = {}
+        self.inbuf = np.zeros((n, 4), dtype=np.int64)
+        self.inhead = np.zeros(n, dtype=np.int64)
+        self.intail = np.zeros(n, dtype=np.int64)
+        self.outbuf = np.zeros((n, 4), dtype=np.int64)
+        self.outlen = np.zeros(n, dtype=np.int64)
+        self._rows = np.arange(n)
+
+    # inputs and outputs
+
+    def feed(self, values, lanes: Optional[np.ndarray] = None):
+        """
+        Queue inputs: one value per lane, as a scalar or an (N,) column,
+        or several per lane as (N, k); `lanes` restricts them to some lanes
+        """
+        if lanes is None:
+            lanes = self._rows
+        lanes = np.asarray(lanes)
+        if lanes.dtype == bool:
+            lanes = np.flatnonzero(lanes)
+        block = np.asarray(values, dtype=object)
+        if block.ndim < 2:
+            block = np.broadcast_to(block.reshape(-1, 1) if block.ndim else block, (len(lanes), 1))
+        for lane in lanes[self.diverged[lanes]]:
+            row = np.flatnonzero(lanes == lane)[0]
+            self.scalar[lane].feed(int(x) for x in block[row])
+        batch = ~self.diverged[lanes]
+        lanes, block = lanes[batch], block[batch].astype(np.int64)
+        k = block.shape[1]
+        self._reserve_inputs(k)
+        cols = self.intail[lanes, None] + np.arange(k)
+        self.inbuf[lanes[:, None], cols] = block
+        self.intail[lanes] += k
+
+    def _reserve_inputs(self, k: int):
+        # drop consumed inputs first, then grow if still short
+        if self.inhead.any():
+            width = self.inbuf.shape[1]
+            cols = (self.inhead[:, None] + np.arange(width)) % width
+            self.inbuf = self.inbuf[self._rows[:, None], cols]
+            self.intail -= self.inhead
+            self.inhead[:] = 0
+        need = int(self.intail.max(initial=0)) + k
+        if need > self.inbuf.shape[1]:
+            grown = np.zeros((self.n, max(need, 2 * self.inbuf.shape[1])), dtype=np.int64)
+            grown[:, : self.inbuf.shape[1]] = self.inbuf
+            self.inbuf = grown
+
+    def drain_output(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Outputs since the last drain as (N, K) values, padded with zeros,
+        and the (N,) count of each lane; OverflowError if a scalar lane
+        has output a value beyond int64
+        """
+        counts = self.outlen.copy()
+        extra = {lane: list(vm.drain_output()) for lane, vm in self.scalar.items()}
+        for lane, values in extra.items():
+            counts[lane] += len(values)
+        out = np.zeros((self.n, int(counts.max(initial=0))), dtype=np.int64)
+        width = min(out.shape[1], self.outbuf.shape[1])
+        fresh = np.arange(width) < self.outlen[:, None]
+        out[:, :width] = np.where(fresh, self.outbuf[:, :width], 0)
+        for lane, values in extra.items():
+            start = self.outlen[lane]
+            out[lane, start : start + len(values)] = values
+        self.outlen[:] = 0
+        return out, counts
+
+    def column(self, addr: int) -> np.ndarray:
+        """Memory word `addr` of every lane; an object array if a lane outgrew int64"""
+        values = self.mem[:, addr] if addr < self.mem.shape[1] else np.zeros(self.n, np.int64)
+        if not self.scalar:
+            return values.copy()
+        res = values.astype(object)
+        for lane, vm in self.scalar.items():
+            res[lane] = vm.memory[addr]
+        try:
+            return res.astype(np.int64)
+        except OverflowError:
+            return res
+
+    # execution
+
+    def _grow(self, size: int):
+        width = self.mem.shape[1]
+        grown = np.zeros((self.n, max(size, 2 * width)), dtype=np.int64)
+        grown[:, :width] = self.mem
+        self.mem = grown
+
+    def _diverge(self, lanes: np.ndarray):
+        for lane in lanes.tolist():
+            vm = IntcodeVM(Memory(self.mem[lane].tolist()), int(self.pc[lane]), int(self.relbase[lane]))
+            vm.feed(self.inbuf[lane, self.inhead[lane] : self.intail[lane]].tolist())
+            self.inhead[lane] = self.intail[lane]
+            self.scalar[lane] = vm
+        self.diverged[lanes] = True
+
+    def _exec(self, opcode: int, lanes: np.ndarray):
+        decoded = _decode(opcode)
+        if decoded is None:
+            self.faulted[lanes] = True
+            return
+        op, modes = decoded
+        if op == 99:
+            self.halted[lanes] = True
+            return
+
+        mem = self.mem
+        pc = self.pc[lanes]
+        raws = [mem[lanes, pc + k] for k in range(1, len(modes) + 1)]
+        addrs = [
+            None if m == 1 else raw if m == 0 else self.relbase[lanes] + raw
+            for m, raw in zip(modes, raws)
+        ]
+        bad = np.zeros(len(lanes), dtype=bool)
+        for a in addrs:
+            if a is not None:
+                bad |= (a < 0) | (a >= self.max_memory)
+        top = max(
+            (int(np.where(bad, -1, a).max()) for a in addrs if a is not None), default=-1
+        )
+        if top >= mem.shape[1]:
+            self._grow(top + 1)
+            mem = self.mem
+        if op in (1, 2):
+            a, b = [
+                raw if addr is None else mem[lanes, np.where(bad, 0, addr)]
+                for raw, addr in zip(raws[:2], addrs[:2])
+            ]
+            est = a.astype(float) * b if op == 2 else a.astype(float) + b
+            bad |= np.abs(est) >= _SAFE
+        if bad.any():
+            self._diverge(lanes[bad])
+            keep = ~bad
+            lanes, pc = lanes[keep], pc[keep]
+            raws = [raw[keep] for raw in raws]
+            addrs = [None if a is None else a[keep] for a in addrs]
+            if not len(lanes):
+                return
+
+        written = _WRITES.get(op)
+        vals = [
+            raw if addr is None or k == written else mem[lanes, addr]
+            for k, (raw, addr) in enumerate(zip(raws, addrs), 1)
+        ]
+        if op == 1:
+            mem[lanes, addrs[2]] = vals[0] + vals[1]
+        elif op == 2:
+            mem[lanes, addrs[2]] = vals[0] * vals[1]
+        elif op == 7:
+            mem[lanes, addrs[2]] = vals[0] < vals[1]
+        elif op == 8:
+            mem[lanes, addrs[2]] = vals[0] == vals[1]
+        elif op == 3:
+            mem[lanes, addrs[0]] = self.inbuf[lanes, self.inhead[lanes]]
+            self.inhead[lanes] += 1
+        elif op == 4:
+            if int(self.outlen[lanes].max()) >= self.outbuf.shape[1]:
+                grown = np.zeros((self.n, 2 * self.outbuf.shape[1]), dtype=np.int64)
+                grown[:, : self.outbuf.shape[1]] = self.outbuf
+                self.outbuf = grown
+            self.outbuf[lanes, self.outlen[lanes]] = vals[0]
+            self.outlen[lanes] += 1
+        elif op == 9:
+            self.relbase[lanes] += vals[0]
+        if op == 5:
+            self.pc[lanes] = np.where(vals[0] != 0, vals[1], pc + 3)
+        elif op == 6:
+            self.pc[lanes] = np.where(vals[0] == 0, vals[1], pc + 3)
+        else:
+            self.pc[lanes] = pc + 1 + len(modes)
+
+    def run(self):
+        """Run every lane until it halts, faults or waits for input"""
+        while True:
+            live = np.flatnonzero(~(self.halted | self.faulted | self.diverged))
+            if not len(live):
+                break
+            pcs = self.pc[live]
+            out = (pcs < 0) | (pcs + 4 >= self.max_memory)
+            if out.any():
+                self._diverge(live[out])
+                live, pcs = live[~out], pcs[~out]
+            if len(pcs) and int(pcs.max()) + 4 >= self.mem.shape[1]:
+                self._grow(int(pcs.max()) + 5)
+            ops = self.mem[live, pcs]
+            waiting = (ops % 100 == 3) & (self.inhead[live] == self.intail[live])
+            live, ops = live[~waiting], ops[~waiting]
+            if not len(live):
+                break
+            for opcode in np.unique(ops).tolist():
+                self._exec(opcode, live[ops == opcode])
+
+        for lane, vm in self.scalar.items():
+            if self.halted[lane] or self.faulted[lane]:
+                continue
+            try:
+                self.halted[lane] = vm.run_until_input()
+            except (IndexError, ValueError):
+                self.faulted[lane] = True
+
+
+def noun_verb_search(program: Sequence[int], target: int, size: int = 100) -> Optional[int]:
+    """
+    100 * noun + verb of the first (noun, verb) in range(size) ** 2 for
+    which the program leaves `target` at address 0, with all pairs run as
+    one batch. The default size covers the puzzle's nouns and verbs 0-99;
+    day02_mod in the 2019 notebook searches range(len(program)) instead.
+
+    >>> noun_verb_search([1, 0, 0, 0, 99], 2, size=5)
+    0
+    """
+    pairs = np.array(list(it.product(range(size), repeat=2)), dtype=np.int64)
+    vm = BatchVM(program, len(pairs))
+    vm.mem[:, 1], vm.mem[:, 2] = pairs[:, 0], pairs[:, 1]
+    vm.run()
+    found = np.flatnonzero((vm.column(0) == target) & vm.halted & ~vm.faulted)
+    if not len(found):
+        return None
+    noun, verb = pairs[found[0]]
+    return int(100 * noun + verb)
@@ -0,0 +1,298 @@
+"""
+Basic-block compiler for Intcode
+
+A basic block is a straight run of instructions starting at some pc and
+ending at the first jump (5, 6), or just before an input (3), a halt (99)
+or an invalid opcode. Each block is translated into one Python function
+with its parameters resolved at compile time, e.g. 1002 at pc 4 with
+parameters 6, 3, 6 becomes
+
+    xs[6] = xs[6] * 3
+
+Inputs and halts are left to the regular interpreter.
+
+Compiled functions are kept in a bounded process-wide LRU cache keyed by
+(words of the block, start pc), so machines running the same program
+share them and a block is compiled again only if its words have changed.
+
+Self-modification
+Every address covered by a compiled block is watched. A write landing on
+a watched address invalidates the blocks covering it, and the writing
+block returns right after the write so that execution continues in
+freshly compiled code. The address is then remembered as volatile: when
+it holds a parameter, blocks read it from memory at run time instead of
+resolving it at compile time, and do not watch it. Programs that patch
+their own operands, like the day 13 game, thus compile each block once.
+
+Memory growth
+Blocks run against the plain list inside Memory. An instruction that
+reaches past the end raises Fault with its own pc; the machine replays
+that single instruction on Memory and carries on.
+
+"""
+import functools
+import sys
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from intcode import _BODY, _WRITES, _negative, DISPATCH, IntcodeVM, Memory
+
+Block = Callable
+
+MAX_BLOCK = 64
+CACHE_SIZE = 1024
+
+# Length of each instruction, opcode word included.
+_LENGTH = {op: nparams + 1 for op, (nparams, _) in _BODY.items()}
+
+# Addresses resolved at compile time: {w} is the parameter word itself.
+# Those that may be negative are checked when the block runs.
+_TARGET = {0: "{w}", 2: "a if (a := relbase + {w}) >= 0 else _negative(a)"}
+_CHECKED = "a if (a := {w}) >= 0 else _negative(a)"
+
+_STORE = {
+    1: "{p1} + {p2}",
+    2: "{p1} * {p2}",
+    7: "1 if {p1} < {p2} else 0",
+    8: "1 if {p1} == {p2} else 0",
+}
+
+
+class Fault(Exception):
+    """An instruction of a block touched memory past the end"""
+
+    def __init__(self, loc: int, relbase: int):
+        super().__init__(loc, relbase)
+        self.loc = loc
+        self.relbase = relbase
+
+
+def _modes(opcode: int, n: int) -> List[int]:
+    return [opcode // 10 ** (k + 2) % 10 for k in range(n)]
+
+
+def _target(mode: int, w) -> str:
+    if mode == 0 and not (isinstance(w, int) and w >= 0):
+        return _CHECKED.format(w=w)
+    return _TARGET[mode].format(w=w)
+
+
+def _param(mode: int, w) -> str:
+    return str(w) if mode == 1 else f"xs[{_target(mode, w)}]"
+
+
+def scan_block(mem: Memory, start: int) -> int:
+    """
+    End (exclusive) of the basic block starting at `start`
+
+    >>> scan_block(Memory([1002, 6, 3, 6, 1105, 1, 0, 99]), 0)
+    7
+    >>> scan_block(Memory([3, 0, 99]), 0)
+    0
+    """
+    loc = start
+    for _ in range(MAX_BLOCK):
+        entry = DISPATCH.get(mem[loc])
+        if entry is None or entry[0] in (3, 99):
+            break
+        op = entry[0]
+        loc += _LENGTH[op]
+        if op in (5, 6):
+            break
+    return loc
+
+
+def _translate(words: Tuple[Optional[int], ...], start: int) -> str:
+    lines = []
+    loc = start
+    end = start + len(words)
+    ended = False
+    while loc < end:
+        opcode = words[loc - start]
+        op = opcode % 100
+        nparams = _LENGTH[op] - 1
+        # volatile parameters (None) are read from memory at run time
+        ws = [
+            f"xs[{a}]" if w is None else w
+            for a, w in enumerate(words[loc - start + 1 : loc - start + 1 + nparams], loc + 1)
+        ]
+        ms = _modes(opcode, nparams)
+        p = [_param(m, w) for m, w in zip(ms, ws)]
+        nxt = loc + 1 + nparams
+        lines.append(f"pc = {loc}")
+        if op in _STORE:
+            lines += [
+                f"t = {_target(ms[2], ws[2])}",
+                f"xs[t] = {_STORE[op].format(p1=p[0], p2=p[1])}",
+                "if t in watch:",
+                f"    return {nxt}, relbase, t",
+            ]
+        elif op == 4:
+            lines.append(f"outputs.append({p[0]})")
+        elif op == 9:
+            lines.append(f"relbase += {p[0]}")
+        else:
+            cond = p[0] if op == 5 else f"not {p[0]}"
+            lines += [
+                f"if {cond}:",
+                f"    return {p[1]}, relbase, None",
+                f"return {nxt}, relbase, None",
+            ]
+            ended = True
+        loc = nxt
+    if not ended:
+        lines.append(f"return {end}, relbase, None")
+    body = "\n".join("        " + line for line in lines)
+    return (
+        f"def _block_{start}(xs, relbase, outputs, watch):\n"
+        f"    pc = {start}\n"
+        f"    try:\n{body}\n"
+        f"    except IndexError:\n"
+        f"        raise Fault(pc, relbase)\n"
+    )
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def compile_block(words: Tuple[Optional[int], ...], start: int) -> Block:
+    """
+    Function running the block of `words` at `start`; parameter words
+    given as None are read from memory when the block runs
+
+    >>> xs = [1001, 0, 5, 6, 99, 0, 0]
+    >>> compile_block((1001, None, 5, None), 0)(xs, 0, [], {}), xs[6]
+    ((4, 0, None), 1006)
+    """
+    src = _translate(words, start)
+    namespace = {"Fault": Fault, "_negative": _negative}
+    exec(compile(src, f"<intcode block {start}>", "exec"), namespace)
+    return namespace[f"_block_{start}"]
+
+
+def _write_target(mem: Memory, loc: int, relbase: int) -> Optional[int]:
+    opcode = mem[loc]
+    op = opcode % 100
+    k = _WRITES.get(op)
+    if k is None:
+        return None
+    addr = mem[loc + k]
+    return relbase + addr if opcode // 10 ** (k + 1) % 10 == 2 else addr
+
+
+class CompiledVM(IntcodeVM):
+    """
+    IntcodeVM that runs compiled basic blocks
+
+    Same interface as IntcodeVM, without tracing or profiling.
+    Writes to memory made from outside between runs must be reported
+    with invalidate().
+
+    >>> vm = CompiledVM([3, 9, 8, 9, 10, 9, 4, 9, 99, -1, 8])
+    >>> vm.feed([8])
+    >>> vm.run_until_input()
+    True
+    >>> vm.drain_output()
+    deque([1])
+    >>> CompiledVM([109, -1, 21101, 5, 5, 0, 104, 7, 99, 0]).run_until_input()
+    Traceback (most recent call last):
+    ...
+    IndexError: negative address -1
+    """
+
+    def __init__(
+        self, program: Iterable[int], loc: int = 0, relbase: int = 0, columnar: bool = False
+    ):
+        super().__init__(program, loc, relbase, fused=False, columnar=columnar)
+        self.blocks: Dict[int, Block] = {}
+        self.spans: Dict[int, List[int]] = {}
+        self.watch: Dict[int, Set[int]] = {}
+        self.volatile: Set[int] = set()
+
+    def fork(self) -> "CompiledVM":
+        other = super().fork()
+        other.blocks = dict(self.blocks)
+        other.spans = dict(self.spans)
+        other.watch = {addr: set(starts) for addr, starts in self.watch.items()}
+        other.volatile = set(self.volatile)
+        return other
+
+    def _compile(self, start: int) -> Optional[Block]:
+        mem = self.memory
+        end = scan_block(mem, start)
+        if end == start:
+            return None
+        words: List[Optional[int]] = [mem[a] for a in range(start, end)]
+        watched = []
+        volatile = self.volatile
+        loc = start
+        while loc < end:
+            watched.append(loc)
+            for addr in range(loc + 1, loc + _LENGTH[words[loc - start] % 100]):
+                if addr in volatile:
+                    words[addr - start] = None
+                else:
+                    watched.append(addr)
+            loc += _LENGTH[words[loc - start] % 100]
+        block = self.blocks[start] = compile_block(tuple(words), start)
+        self.spans[start] = watched
+        for addr in watched:
+            self.watch.setdefault(addr, set()).add(start)
+        return block
+
+    def invalidate(self, addr: int):
+        self.volatile.add(addr)
+        for start in self.watch.pop(addr, ()):
+            self.blocks.pop(start, None)
+            for a in self.spans.pop(start):
+                starts = self.watch.get(a)
+                if starts is not None:
+                    starts.discard(start)
+                    if not starts:
+                        del self.watch[a]
+
+    def _interpret(self) -> bool:
+        """Execute the instruction at self.loc on Memory; False if it can't proceed"""
+        target = _write_target(self.memory, self.loc, self.relbase)
+        progressed = self.step()
+        if progressed and target is not None and target in self.watch:
+            self.invalidate(target)
+        return progressed
+
+    def run_until_input(self, max_outputs: Optional[int] = None) -> bool:
+        """
+        Run until an input is needed and none is queued; True if halted
+
+        `max_outputs` is checked between blocks, so a block emitting
+        several outputs may take the queue past it.
+        """
+        self.memory.unshare()
+        xs = self.memory.data
+        blocks = self.blocks
+        watch = self.watch
+        outputs = self.outputs
+        limit = sys.maxsize if max_outputs is None else max_outputs
+        loc, relbase = self.loc, self.relbase
+        try:
+            while True:
+                block = blocks.get(loc)
+                if block is None:
+                    block = self._compile(loc)
+                if block is None:
+                    self.loc, self.relbase = loc, relbase
+                    progressed = self._interpret()
+                    loc, relbase = self.loc, self.relbase
+                    if not progressed or len(outputs) >= limit:
+                        break
+                    continue
+                try:
+                    loc, relbase, dirty = block(xs, relbase, outputs, watch)
+                except Fault as fault:
+                    self.loc, self.relbase = fault.loc, fault.relbase
+                    self._interpret()
+                    loc, relbase = self.loc, self.relbase
+                    continue
+                if dirty is not None:
+                    self.invalidate(dirty)
+                if len(outputs) >= limit:
+                    break
+        finally:
+            self.loc, self.relbase = loc, relbase
+        return self.halted
@@ -0,0 +1,231 @@
+"""
+Networks of Intcode machines
+
+A Scheduler runs any number of IntcodeVMs in a single thread, round-robin.
+Each machine runs until it needs an input that has not arrived; there are
+no tasks, futures or event loop between messages.
+
+Machines talk over Channels: bounded ring buffers with one writer and one
+reader. A machine with an outbox runs with an output budget of the room
+left in it, so it stops as soon as its outputs would no longer fit; they
+are then moved into the outbox. Those that do not fit stay queued in the
+machine, and it is not run again until they are delivered, so a fast
+producer cannot flood a slow consumer. A machine that halts closes its
+outbox.
+
+When a full round makes no progress while some machine is still
+running, every machine is waiting on an empty inbox or a full outbox and
+the network can never finish; run() then raises Deadlock.
+
+"""
+from typing import List, Optional
+
+from intcode import IntcodeVM
+
+
+class Deadlock(RuntimeError):
+    """Every machine still running is blocked"""
+
+    def __init__(self, blocked: List[str]):
+        super().__init__(f"deadlock: {', '.join(blocked)}")
+        self.blocked = blocked
+
+
+class Channel(object):
+    """
+    Bounded FIFO of ints over a fixed ring buffer
+
+    >>> ch = Channel(2)
+    >>> ch.put(1), ch.put(2), ch.put(3)
+    (True, True, False)
+    >>> ch.get(), len(ch), ch.free()
+    (1, 1, 1)
+    """
+
+    __slots__ = ("buf", "head", "count", "closed")
+
+    def __init__(self, capacity: int = 64):
+        self.buf = [0] * capacity
+        self.head = 0
+        self.count = 0
+        self.closed = False
+
+    def __len__(self) -> int:
+        return self.count
+
+    def free(self) -> int:
+        return len(self.buf) - self.count
+
+    def put(self, value: int) -> bool:
+        """Append `value`; False if the channel is full"""
+        size = len(self.buf)
+        if self.count == size:
+            return False
+        self.buf[(self.head + self.count) % size] = value
+        self.count += 1
+        return True
+
+    def get(self) -> int:
+        if not self.count:
+            raise IndexError("get from an empty channel")
+        value = self.buf[self.head]
+        self.head = (self.head + 1) % len(self.buf)
+        self.count -= 1
+        return value
+
+    def close(self):
+        """No more values will be put; the reader sees end of stream once empty"""
+        self.closed = True
+
+    @property
+    def eof(self) -> bool:
+        return self.closed and not self.count
+
+
+class Process(object):
+    """A machine in a Scheduler, with its channels"""
+
+    def __init__(
+        self,
+        vm: IntcodeVM,
+        inbox: Optional[Channel],
+        outbox: Optional[Channel],
+        name: str,
+    ):
+        self.vm = vm
+        self.inbox = inbox
+        self.outbox = outbox
+        self.name = name
+        self.started = False
+
+    def done(self) -> bool:
+        return self.vm.halted and not (self.vm.outputs and self.outbox is not None)
+
+    def state(self) -> str:
+        if self.vm.outputs and self.outbox is not None:
+            return "output"
+        if self.vm.halted:
+            return "halted"
+        return "input"
+
+    def flush(self) -> bool:
+        outputs = self.vm.outputs
+        outbox = self.outbox
+        if outbox is None:
+            return False
+        moved = False
+        while outputs and outbox.put(outputs[0]):
+            outputs.popleft()
+            moved = True
+        if self.vm.halted and not outputs:
+            outbox.close()
+        return moved
+
+    def waiting(self) -> bool:
+        """Stopped at an input instruction with no input queued"""
+        vm = self.vm
+        return not vm.inputs and vm.memory[vm.loc] % 100 == 3
+
+    def step(self) -> bool:
+        """
+        Deliver outputs, take inputs and run if possible; True on progress
+
+        A machine that outputs without end stops once its outbox is full:
+
+        >>> proc = Scheduler().spawn(IntcodeVM([104, 7, 1105, 1, 0]), None, Channel(4))
+        >>> proc.step(), len(proc.outbox), len(proc.vm.outputs)
+        (True, 4, 0)
+        >>> proc.step(), len(proc.outbox), len(proc.vm.outputs)
+        (True, 4, 1)
+        >>> proc.step()
+        False
+        """
+        vm = self.vm
+        progressed = self.flush()
+        if vm.halted or (vm.outputs and self.outbox is not None):
+            return progressed
+        inbox = self.inbox
+        # take inputs only once the last ones are used up, so that they
+        # stay bounded by the inbox as well
+        if inbox is not None and not vm.inputs:
+            while inbox.count:
+                vm.inputs.append(inbox.get())
+                progressed = True
+        if self.started and self.waiting():
+            return progressed
+        self.started = True
+        vm.run_until_input(None if self.outbox is None else self.outbox.free())
+        self.flush()
+        return True
+
+
+class Scheduler(object):
+    """
+    Round-robin runner of connected machines
+
+    A chain of 50 machines, each adding 1 to what it receives:
+
+    >>> net = Scheduler()
+    >>> chs = [Channel(4) for _ in range(51)]
+    >>> for i in range(50):
+    ...     _ = net.spawn(IntcodeVM([3, 9, 1001, 9, 1, 9, 4, 9, 99, 0]), chs[i], chs[i + 1])
+    >>> chs[0].put(0)
+    True
+    >>> net.run()
+    >>> chs[-1].get(), chs[-1].eof
+    (50, True)
+
+    Two machines both waiting for the other:
+
+    >>> net = Scheduler()
+    >>> a, b = Channel(), Channel()
+    >>> _ = net.spawn(IntcodeVM([3, 0, 4, 0, 99]), a, b, name="ping")
+    >>> _ = net.spawn(IntcodeVM([3, 0, 4, 0, 99]), b, a, name="pong")
+    >>> net.run()
+    Traceback (most recent call last):
+    ...
+    intcode_net.Deadlock: deadlock: ping (input), pong (input)
+    """
+
+    def __init__(self):
+        self.procs: List[Process] = []
+
+    def spawn(
+        self,
+        vm: IntcodeVM,
+        inbox: Optional[Channel] = None,
+        outbox: Optional[Channel] = None,
+        name: Optional[str] = None,
+    ) -> Process:
+        """
+        Add `vm` to the network. Without an outbox its outputs stay in
+        vm.outputs for the caller. Columnar machines are refused: their
+        outputs are handed over in blocks, not one value at a time.
+
+        >>> Scheduler().spawn(IntcodeVM([99], columnar=True))
+        Traceback (most recent call last):
+        ...
+        ValueError: Scheduler cannot run columnar machines
+        """
+        if vm.columnar:
+            raise ValueError("Scheduler cannot run columnar machines")
+        proc = Process(vm, inbox, outbox, name or f"vm-{len(self.procs)}")
+        self.procs.append(proc)
+        return proc
+
+    def run(self):
+        """Run until every machine has halted and delivered its outputs"""
+        procs = self.procs
+        while True:
+            progressed = False
+            done = True
+            for proc in procs:
+                if proc.step():
+                    progressed = True
+                if not proc.done():
+                    done = False
+            if done:
+                return
+            if not progressed:
+                blocked = [f"{p.name} ({p.state()})" for p in procs if not p.done()]
+                raise Deadlock(blocked)
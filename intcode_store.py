@@ -0,0 +1,282 @@
+"""
+On-disk formats for Intcode machines
+
+Checkpoint
+Full state of an IntcodeVM: pc, relative base, halt flag, memory and the
+queued inputs and outputs, plus optional JSON metadata of the driver
+(e.g. the game board). Layout, little-endian, zlib-compressed after the
+magic:
+
+    b"ICVM" version:u8
+    loc:i64 relbase:i64 halted:u8
+    memory, inputs, outputs    each as an int sequence
+    metadata length:u64, UTF-8 JSON
+
+An int sequence is an int64 array, with values that do not fit 64 bits
+stored as zeros in the array and listed after it:
+
+    count:u64 nbig:u64 int64[count] (index:u64 length:u32 decimal)[nbig]
+
+Files are written to a unique temporary name in the same directory and
+renamed, so an interrupted save never leaves a truncated file behind, and
+processes saving the same file at once never write into each other's.
+
+Program image
+A parsed program, uncompressed so that it can be memory-mapped:
+
+    b"ICIM" version:u8 padding:3 sha256:32    hash of the int sequence bytes
+    int sequence                             int64 array at offset 56
+
+Loading an image maps the file, checks the hash over the mapped bytes and
+converts the int64 array in a single C-level pass, without any text
+parsing.
+The result is kept per process as a base Memory, and every machine
+started from the image gets a copy-on-write fork of it, so launching
+many machines on one program copies nothing until each of them runs.
+
+"""
+import array
+import contextlib
+import functools
+import hashlib
+import io
+import json
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import zlib
+from typing import BinaryIO, Dict, List, Optional, Sequence, Tuple, Type
+
+from intcode import IntcodeVM, Memory
+
+MAGIC = b"ICVM"
+VERSION = 1
+
+IMAGE_MAGIC = b"ICIM"
+IMAGE_VERSION = 2
+
+INT64_MIN = -(2 ** 63)
+INT64_MAX = 2 ** 63 - 1
+
+
+def _write_ints(f: BinaryIO, values: Sequence[int]):
+    big = [(i, x) for i, x in enumerate(values) if not INT64_MIN <= x <= INT64_MAX]
+    if big:
+        values = list(values)
+        for i, _ in big:
+            values[i] = 0
+    xs = array.array("q", values)
+    if sys.byteorder == "big":
+        xs.byteswap()
+    f.write(struct.pack("<QQ", len(xs), len(big)))
+    f.write(xs.tobytes())
+    for i, x in big:
+        digits = str(x).encode()
+        f.write(struct.pack("<QI", i, len(digits)))
+        f.write(digits)
+
+
+def _read_ints(f: BinaryIO) -> List[int]:
+    count, nbig = struct.unpack("<QQ", f.read(16))
+    xs = array.array("q")
+    xs.frombytes(f.read(8 * count))
+    if sys.byteorder == "big":
+        xs.byteswap()
+    values = xs.tolist()
+    for _ in range(nbig):
+        i, length = struct.unpack("<QI", f.read(12))
+        values[i] = int(f.read(length))
+    return values
+
+
+def _ints_bytes(values: Sequence[int]) -> bytes:
+    f = io.BytesIO()
+    _write_ints(f, values)
+    return f.getvalue()
+
+
+def program_hash(values: Sequence[int]) -> str:
+    """
+    SHA-256 of the program stored as an int sequence, as in an image
+
+    >>> program_hash([1, 0, 0, 0, 99])[:16]
+    'd247d5581e9c9223'
+    """
+    return hashlib.sha256(_ints_bytes(values)).hexdigest()
+
+
+@contextlib.contextmanager
+def _replacing(path):
+    """Binary file that replaces `path` once it has been written in full"""
+    fd, tmp = tempfile.mkstemp(
+        prefix=f"{os.path.basename(path)}.",
+        suffix=".tmp",
+        dir=os.path.dirname(os.path.abspath(path)),
+    )
+    try:
+        with os.fdopen(fd, "wb") as f:
+            yield f
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def save_checkpoint(vm: IntcodeVM, path, meta: Optional[Dict] = None):
+    """
+    >>> import tempfile
+    >>> vm = IntcodeVM([3, 9, 8, 9, 10, 9, 4, 9, 99, -1, 8])
+    >>> vm.run_until_input()
+    False
+    >>> path = os.path.join(tempfile.mkdtemp(), "vm.ckpt")
+    >>> save_checkpoint(vm, path, meta={"frame": 1})
+    >>> restored, meta = load_checkpoint(path)
+    >>> restored.feed([8]); restored.run_until_input()
+    True
+    >>> restored.drain_output(), meta
+    (deque([1]), {'frame': 1})
+    """
+    body = io.BytesIO()
+    body.write(struct.pack("<qqB", vm.loc, vm.relbase, vm.halted))
+    _write_ints(body, vm.memory.data)
+    _write_ints(body, vm.inputs)
+    _write_ints(body, vm.outputs)
+    encoded = json.dumps(meta).encode()
+    body.write(struct.pack("<Q", len(encoded)))
+    body.write(encoded)
+
+    with _replacing(path) as f:
+        f.write(MAGIC + bytes([VERSION]))
+        f.write(zlib.compress(body.getvalue()))
+
+
+def load_checkpoint(
+    path, cls: Type[IntcodeVM] = IntcodeVM
+) -> Tuple[IntcodeVM, Optional[Dict]]:
+    with open(path, "rb") as f:
+        head = f.read(len(MAGIC) + 1)
+        if head[:-1] != MAGIC or head[-1] != VERSION:
+            raise ValueError(f"Not an Intcode checkpoint: {path}")
+        body = io.BytesIO(zlib.decompress(f.read()))
+
+    loc, relbase, halted = struct.unpack("<qqB", body.read(17))
+    vm = cls(Memory(_read_ints(body)), loc, relbase)
+    vm.halted = bool(halted)
+    vm.feed(_read_ints(body))
+    vm.outputs.extend(_read_ints(body))
+    (length,) = struct.unpack("<Q", body.read(8))
+    meta = json.loads(body.read(length))
+    return vm, meta
+
+
+class ProgramImage(object):
+    """
+    Program loaded from an image file
+
+    >>> import tempfile
+    >>> path = os.path.join(tempfile.mkdtemp(), "prog.img")
+    >>> write_image([104, 1125899906842624, 99], path)
+    >>> image = load_image(path)
+    >>> len(image), image.digest == program_hash([104, 1125899906842624, 99])
+    (3, True)
+    >>> vm = image.vm()
+    >>> vm.run_until_input()
+    True
+    >>> vm.drain_output()
+    deque([1125899906842624])
+
+    Truncated or altered images are refused:
+
+    >>> with open(path, "r+b") as f:
+    ...     _ = f.seek(56)
+    ...     _ = f.write(bytes([105]))
+    >>> load_image(path)  # doctest: +ELLIPSIS
+    Traceback (most recent call last):
+    ...
+    ValueError: Intcode program image does not match its hash: ...
+    """
+
+    def __init__(self, base: Memory, digest: str):
+        self.base = base
+        self.digest = digest
+
+    def __len__(self) -> int:
+        return len(self.base)
+
+    def memory(self) -> Memory:
+        return self.base.fork()
+
+    def vm(self, cls: Type[IntcodeVM] = IntcodeVM, **kwargs) -> IntcodeVM:
+        return cls(self.memory(), **kwargs)
+
+
+def write_image(values: Sequence[int], path):
+    ints = _ints_bytes(values)
+    with _replacing(path) as f:
+        f.write(IMAGE_MAGIC + bytes([IMAGE_VERSION, 0, 0, 0]))
+        f.write(hashlib.sha256(ints).digest())
+        f.write(ints)
+
+
+@functools.lru_cache(maxsize=16)
+def _load_image(path: str, mtime: float) -> ProgramImage:
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+        if len(m) < 56 or m[:4] != IMAGE_MAGIC or m[4] != IMAGE_VERSION:
+            raise ValueError(f"Not an Intcode program image: {path}")
+        digest = m[8:40].hex()
+        count, nbig = struct.unpack_from("<QQ", m, 40)
+        if 56 + 8 * count + 12 * nbig > len(m):
+            raise ValueError(f"Truncated Intcode program image: {path}")
+        with memoryview(m)[40:] as view:
+            if hashlib.sha256(view).hexdigest() != digest:
+                raise ValueError(f"Intcode program image does not match its hash: {path}")
+        with memoryview(m)[56 : 56 + 8 * count] as view:
+            if sys.byteorder == "big":
+                xs = array.array("q", view.tobytes())
+                xs.byteswap()
+                values = xs.tolist()
+            else:
+                with view.cast("q") as ints:
+                    values = ints.tolist()
+        pos = 56 + 8 * count
+        for _ in range(nbig):
+            if pos + 12 > len(m):
+                raise ValueError(f"Truncated Intcode program image: {path}")
+            i, length = struct.unpack_from("<QI", m, pos)
+            if i >= count or pos + 12 + length > len(m):
+                raise ValueError(f"Truncated Intcode program image: {path}")
+            values[i] = int(m[pos + 12 : pos + 12 + length])
+            pos += 12 + length
+    return ProgramImage(Memory(values), digest)
+
+
+def load_image(path) -> ProgramImage:
+    """
+    Image of `path`, loaded once per process for each version of the
+    file among the last few loaded
+    """
+    path = os.path.abspath(path)
+    return _load_image(path, os.stat(path).st_mtime)
+
+
+def load_program(text_path) -> ProgramImage:
+    """
+    Image of a comma-separated Intcode program, compiled next to it as
+    `<text_path>.img` on first use, whenever the text is newer and when
+    the image can't be loaded, e.g. after a format change
+    """
+    image_path = f"{text_path}.img"
+    stale = (
+        not os.path.exists(image_path)
+        or os.stat(image_path).st_mtime < os.stat(text_path).st_mtime
+    )
+    if not stale:
+        try:
+            return load_image(image_path)
+        except ValueError:
+            pass
+    values = [int(x) for x in open(text_path).read().strip().split(",")]
+    write_image(values, image_path)
+    return load_image(image_path)
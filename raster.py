@@ -0,0 +1,318 @@
+"""
+Rendering of sparse grids
+
+The puzzles keep their screens as sparse maps {(x, y): code}. rasterize()
+turns such a map into a dense NumPy array in a single pass over its items;
+text, terminal and PBM/PGM output are then whole-array operations.
+
+Codes are small ints. Maps of other values (e.g. the characters of the
+day 15 map) are translated with `codes`, a sequence whose positions give
+the ints. Cells missing from the map get `fill`.
+
+Row 0 of the array is the lowest y, so screens whose y grows downwards
+(day 13) print as is, while maps whose y grows upwards (days 11, 15) are
+rasterized with flip_y=True.
+
+Screen-protocol programs emit (x, y, code) triplets. A Board keeps such a
+screen as a dense array and applies a whole block of triplets, e.g. the
+columnar output of an IntcodeVM seen through output_block(), as one
+vectorized scatter.
+
+Interactive loops draw through a TerminalView, which keeps the previous
+frame and writes only the cells that changed, using cursor-addressing
+escape codes. It redraws everything only when the bounding box moves,
+and it can be throttled to a frame rate or disabled for headless runs.
+
+"""
+import array
+import itertools as it
+import sys
+import time
+from typing import Dict, Hashable, Iterable, Mapping, Optional, Sequence, TextIO, Tuple
+
+import numpy as np
+
+Position = Tuple[int, int]
+
+
+class Raster(object):
+    """
+    Dense image of a sparse grid
+
+    >>> r = rasterize({(0, 0): 1, (2, 1): 2})
+    >>> r.grid
+    array([[1, 0, 0],
+           [0, 0, 2]], dtype=uint8)
+    >>> print(r.text(".#X", marks={(1, 1): "D"}))
+    #..
+    .DX
+    >>> print(rasterize({(0, 0): 1, (2, 1): 2}, flip_y=True).text(".#X"))
+    ..X
+    #..
+    """
+
+    def __init__(self, grid: np.ndarray, origin: Position, flip_y: bool):
+        self.grid = grid
+        self.origin = origin
+        self.flip_y = flip_y
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        return self.grid.shape
+
+    def index(self, pos: Position) -> Tuple[int, int]:
+        """(row, column) of the cell at `pos`"""
+        x, y = pos
+        x0, y0 = self.origin
+        row = y - y0
+        if self.flip_y:
+            row = self.grid.shape[0] - 1 - row
+        return row, x - x0
+
+    def chars(self, palette: Sequence[str], marks: Optional[Dict[Position, str]] = None) -> np.ndarray:
+        """Array of one-character strings, with `marks` drawn over the cells"""
+        out = np.asarray(list(palette))[self.grid]
+        for pos, c in (marks or {}).items():
+            row, col = self.index(pos)
+            if 0 <= row < out.shape[0] and 0 <= col < out.shape[1]:
+                out[row, col] = c
+        return out
+
+    def text(self, palette: Sequence[str], marks: Optional[Dict[Position, str]] = None) -> str:
+        return "\n".join("".join(row) for row in self.chars(palette, marks))
+
+    def show(
+        self,
+        palette: Sequence[str],
+        marks: Optional[Dict[Position, str]] = None,
+        file: Optional[TextIO] = None,
+    ):
+        print(self.text(palette, marks), file=file or sys.stdout)
+
+    def to_pbm(self, path, on: Iterable[int] = (1,)):
+        """Write a binary PBM with the cells of codes in `on` black"""
+        bits = np.isin(self.grid, list(on))
+        height, width = bits.shape
+        with open(path, "wb") as f:
+            f.write(f"P4\n{width} {height}\n".encode())
+            f.write(np.packbits(bits, axis=1).tobytes())
+
+    def to_pgm(self, path, levels: Optional[Sequence[int]] = None):
+        """
+        Write a binary PGM; code k gets gray `levels[k]`, by default
+        spread evenly from black to white
+        """
+        if levels is None:
+            top = max(int(self.grid.max()), 1)
+            levels = [round(255 * k / top) for k in range(top + 1)]
+        gray = np.asarray(levels, dtype=np.uint8)[self.grid]
+        height, width = gray.shape
+        with open(path, "wb") as f:
+            f.write(f"P5\n{width} {height}\n255\n".encode())
+            f.write(gray.tobytes())
+
+
+def rasterize(
+    cells: Mapping[Position, Hashable],
+    codes: Optional[Sequence[Hashable]] = None,
+    fill: int = 0,
+    flip_y: bool = False,
+    exclude: Iterable[Position] = (),
+) -> Raster:
+    """
+    Raster of the cells of a sparse map, cropped to their bounding box
+
+    >>> rasterize({(5, 5): "#", (6, 5): "."}, codes=" #.").grid
+    array([[1, 2]], dtype=uint8)
+    >>> rasterize({(-1, 0): 12345, (0, 0): 3}, exclude=[(-1, 0)]).grid
+    array([[3]], dtype=uint8)
+    """
+    items = list(cells.items())
+    n = len(items)
+    xy = np.fromiter(
+        it.chain.from_iterable(pos for pos, _ in items), dtype=np.int64, count=2 * n
+    ).reshape(n, 2)
+    if codes is None:
+        values = np.fromiter((v for _, v in items), dtype=np.int64, count=n)
+    else:
+        index = {c: k for k, c in enumerate(codes)}
+        values = np.fromiter((index[v] for _, v in items), dtype=np.int64, count=n)
+
+    keep = np.ones(n, dtype=bool)
+    for x, y in exclude:
+        keep &= (xy[:, 0] != x) | (xy[:, 1] != y)
+    xy, values = xy[keep], values[keep]
+    if not len(values):
+        return Raster(np.zeros((0, 0), dtype=np.uint8), (0, 0), flip_y)
+
+    lo = xy.min(axis=0)
+    width, height = xy.max(axis=0) - lo + 1
+    grid = np.full((height, width), fill, dtype=np.uint8)
+    cols, rows = (xy - lo).T
+    if flip_y:
+        rows = height - 1 - rows
+    grid[rows, cols] = values
+    return Raster(grid, (int(lo[0]), int(lo[1])), flip_y)
+
+
+def output_block(values: Sequence[int], width: int) -> np.ndarray:
+    """
+    Output values as rows of `width`; an int64 array.array is viewed
+    without copying
+
+    >>> import array
+    >>> output_block(array.array("q", [1, 2, 3, 4, 5, 6]), 3)
+    array([[1, 2, 3],
+           [4, 5, 6]])
+    """
+    if isinstance(values, array.array) and values.typecode == "q":
+        flat = np.frombuffer(values, dtype=np.int64)
+    else:
+        flat = np.fromiter(values, dtype=np.int64, count=len(values))
+    return flat.reshape(-1, width)
+
+
+class Board(object):
+    """
+    Dense screen that grows to fit the cells written to it
+
+    >>> board = Board()
+    >>> board.scatter(np.array([[0, 0, 1], [2, 1, 2], [0, 0, 3]]))
+    >>> board.grid, board[(0, 0)], board[(9, 9)], board.count(2)
+    (array([[3, 0, 0],
+           [0, 0, 2]], dtype=uint8), 3, 0, 1)
+    """
+
+    def __init__(self, fill: int = 0):
+        self.fill = fill
+        self.grid = np.zeros((0, 0), dtype=np.uint8)
+        self.origin = (0, 0)
+
+    def _fit(self, xs: np.ndarray, ys: np.ndarray):
+        height, width = self.grid.shape
+        x0, y0 = self.origin
+        if height and width:
+            lo_x, lo_y = min(x0, xs.min()), min(y0, ys.min())
+            hi_x, hi_y = max(x0 + width - 1, xs.max()), max(y0 + height - 1, ys.max())
+        else:
+            lo_x, lo_y, hi_x, hi_y = xs.min(), ys.min(), xs.max(), ys.max()
+        if (lo_x, lo_y, hi_x - lo_x + 1, hi_y - lo_y + 1) == (x0, y0, width, height):
+            return
+        grid = np.full((hi_y - lo_y + 1, hi_x - lo_x + 1), self.fill, dtype=np.uint8)
+        grid[y0 - lo_y : y0 - lo_y + height, x0 - lo_x : x0 - lo_x + width] = self.grid
+        self.grid = grid
+        self.origin = (int(lo_x), int(lo_y))
+
+    def scatter(self, block: np.ndarray):
+        """Write the rows (x, y, code) of `block`; later rows win"""
+        if not len(block):
+            return
+        xs, ys, codes = block[:, 0], block[:, 1], block[:, 2]
+        self._fit(xs, ys)
+        x0, y0 = self.origin
+        flat = (ys - y0) * self.grid.shape[1] + (xs - x0)
+        # fancy assignment leaves the winner among duplicates unspecified
+        _, last = np.unique(flat[::-1], return_index=True)
+        keep = len(flat) - 1 - last
+        self.grid.flat[flat[keep]] = codes[keep]
+
+    def __getitem__(self, pos: Position) -> int:
+        x, y = pos
+        x0, y0 = self.origin
+        height, width = self.grid.shape
+        if 0 <= x - x0 < width and 0 <= y - y0 < height:
+            return int(self.grid[y - y0, x - x0])
+        return self.fill
+
+    def count(self, code: int) -> int:
+        return int(np.count_nonzero(self.grid == code))
+
+    def raster(self, flip_y: bool = False) -> Raster:
+        grid = self.grid[::-1] if flip_y else self.grid
+        return Raster(grid, self.origin, flip_y)
+
+
+class TerminalView(object):
+    """
+    Incremental terminal renderer of sparse grids
+
+    Row 1 of the terminal holds a status line, and the grid starts on row 2.
+
+    >>> import io
+    >>> out = io.StringIO()
+    >>> view = TerminalView(max_fps=None, file=out)
+    >>> view.draw({(0, 0): 1, (1, 0): 0}, ".#", status="t=0")
+    True
+    >>> out.getvalue()
+    '\\x1b[H\\x1b[2Jt=0\\x1b[2;1H#.\\x1b[3;1H'
+    >>> _ = out.seek(0), out.truncate()
+    >>> view.draw({(0, 0): 1, (1, 0): 1}, ".#", status="t=0")
+    True
+    >>> out.getvalue()
+    '\\x1b[2;2H#\\x1b[3;1H'
+    >>> TerminalView(enabled=False).draw({(0, 0): 1}, ".#")
+    False
+    """
+
+    def __init__(
+        self,
+        max_fps: Optional[float] = 30.0,
+        enabled: bool = True,
+        file: Optional[TextIO] = None,
+    ):
+        self.interval = 1.0 / max_fps if max_fps else 0.0
+        self.enabled = enabled
+        self.file = file
+        self.last = -float("inf")
+        self.prev: Optional[np.ndarray] = None
+        self.origin: Optional[Position] = None
+        self.status: Optional[str] = None
+
+    def reset(self):
+        """Forget the previous frame, so that the next one is drawn in full"""
+        self.prev = self.origin = self.status = None
+
+    def draw(
+        self,
+        cells: Mapping[Position, Hashable],
+        palette: Sequence[str],
+        codes: Optional[Sequence[Hashable]] = None,
+        marks: Optional[Dict[Position, str]] = None,
+        flip_y: bool = False,
+        exclude: Iterable[Position] = (),
+        status: Optional[str] = None,
+        force: bool = False,
+    ) -> bool:
+        """
+        Bring the terminal up to date with `cells`; False if the frame was
+        skipped because the view is disabled or within the frame interval.
+        Pass force=True for frames that must be seen, e.g. the last one.
+        """
+        if not self.enabled:
+            return False
+        now = time.monotonic()
+        if not force and now - self.last < self.interval:
+            return False
+        self.last = now
+
+        raster = rasterize(cells, codes=codes, flip_y=flip_y, exclude=exclude)
+        chars = raster.chars(palette, marks)
+        out = []
+        prev = self.prev
+        if prev is None or prev.shape != chars.shape or self.origin != raster.origin:
+            out.append("\x1b[H\x1b[2J")
+            out.append(status or "")
+            for r, row in enumerate(chars):
+                out.append(f"\x1b[{r + 2};1H" + "".join(row))
+        else:
+            if status != self.status:
+                out.append("\x1b[H\x1b[2K" + (status or ""))
+            for r, c in zip(*np.nonzero(chars != prev)):
+                out.append(f"\x1b[{r + 2};{c + 1}H{chars[r, c]}")
+        out.append(f"\x1b[{chars.shape[0] + 2};1H")
+
+        self.prev, self.origin, self.status = chars, raster.origin, status
+        file = self.file or sys.stdout
+        file.write("".join(out))
+        file.flush()
+        return True
@@ -2,6 +2,9 @@ import pathlib
 import bs4
 import urllib
 
+from intcode import Memory
+from intcode_store import load_program
+
 
 def get_title(day):
     f = urllib.request.urlopen(f"https://adventofcode.com/2019/day/{day}")
@@ -13,5 +16,5 @@ def get_path(day):
     return pathlib.Path(f"./2019/day{day:02}.txt")
 
 
-def read_intcode(path):
-    return [int(x) for x in open(path).read().strip().split(",")]
+def read_intcode(path) -> Memory:
+    return load_program(path).memory()